@@ -1,16 +1,21 @@
-from django import VERSION as DJANGO_VERSION
+import json
+
 from django.contrib import admin
 from django.contrib.admin.filters import ChoicesFieldListFilter, FieldListFilter
-from django.db.models import Count
+from django.core.exceptions import PermissionDenied
+from django.db.models import Prefetch
+from django.http import HttpResponseNotAllowed, JsonResponse
 from django.utils.encoding import smart_text
 from django.utils.html import format_html, mark_safe
 from django.utils.translation import gettext_lazy as _
 
 from imagekit.admin import AdminThumbnail
 
+from .cache import get_category_filter_choices
 from .conf import USE_TRANSLATABLE_FIELDS
 from .forms import MediaCategoryAdminForm
-from . import admin_actions, mixins, models
+from . import admin_actions, mixins, models, search
+from .paginator import CURSOR_VAR, KeysetChangeList, KeysetPaginator
 
 if USE_TRANSLATABLE_FIELDS:
     from shared.multilingual.utils import i18n_fields, lang_suffix
@@ -22,6 +27,15 @@ else:
         return fieldname
 
 
+def is_id(value):
+    """
+    Primary key given as JSON number or form value.
+    """
+    if isinstance(value, str):
+        return value.isdecimal()
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
 class CategoryFieldListFilter(ChoicesFieldListFilter):
     """
     Customization of ChoicesFilterSpec which sorts in the user-expected format.
@@ -36,26 +50,9 @@ class CategoryFieldListFilter(ChoicesFieldListFilter):
         super(CategoryFieldListFilter, self).__init__(
             f, request, params, model, model_admin, field_path)
 
-        # Restrict results to categories which are actually in use:
-        if DJANGO_VERSION < (1, 8):
-            related_model = f.related.parent_model
-            related_name = f.related.var_name
-        elif DJANGO_VERSION < (2, 0):
-            related_model = f.rel.to
-            related_name = f.related_query_name()
-        else:
-            related_model = f.remote_field.model
-            related_name = f.related_query_name()
-
-        self.lookup_choices = sorted(
-            [
-                (i.pk, '%s (%s)' % (i, i._related_count))
-                for i in related_model.objects.annotate(
-                    _related_count=Count(related_name)
-                ).exclude(_related_count=0)
-            ],
-            key=lambda i: i[1],
-        )
+        # Restrict results to categories which are actually in use, the
+        # choices are cached and invalidated by .signals
+        self.lookup_choices = get_category_filter_choices(f)
 
     def choices(self, cl):
         yield {
@@ -81,6 +78,7 @@ FieldListFilter.register(
 @admin.register(models.MediaCategory)
 class MediaCategoryAdmin(admin.ModelAdmin):
     form = MediaCategoryAdminForm
+    actions = [admin_actions.download_zip]
     list_display = ['path']
     list_filter = ['parent']
     list_per_page = 25
@@ -100,7 +98,20 @@ class MediaRoleAdmin(admin.ModelAdmin):
     list_display = i18n_fields('name')
 
 
-class MediaAdminBase(admin_actions.MediaBaseActionsMixin, mixins.DropUploadAdminMixin, admin.ModelAdmin):
+class SearchDocumentAdminMixin:
+    """
+    Searches the denormalized search document instead of OR-ing
+    icontains lookups over all ``search_fields``.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search.search(queryset, search_term), False
+
+
+class MediaAdminBase(admin_actions.MediaBaseActionsMixin, mixins.DropUploadAdminMixin,
+                     SearchDocumentAdminMixin, admin.ModelAdmin):
     list_display = ['is_public', 'admin_thumbnail', 'get_name_display',
         'get_categories_display',
         'modified']  # , 'created']
@@ -117,6 +128,8 @@ class MediaAdminBase(admin_actions.MediaBaseActionsMixin, mixins.DropUploadAdmin
     ]
     date_hierarchy = 'modified'
     ordering = ['-modified']
+    paginator = KeysetPaginator
+    show_full_result_count = False
 
     fieldsets = (
         (None, {
@@ -146,6 +159,20 @@ class MediaAdminBase(admin_actions.MediaBaseActionsMixin, mixins.DropUploadAdmin
 
     # TODO class Media: add switch_languages script
 
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return self.paginator(
+            queryset, per_page, orphans, allow_empty_first_page,
+            cursor=request.GET.get(CURSOR_VAR))
+
+    def get_queryset(self, request):
+        # Both category columns render from the same prefetch cache,
+        # including the parents needed by MediaCategory.__str__.
+        return super().get_queryset(request).prefetch_related(
+            Prefetch('categories', queryset=models.MediaCategory.objects.select_related('parent')))
+
     def get_name_display(self, obj):
         return format_html(
             "<small>{categories}</small><br>{caption}",
@@ -167,6 +194,9 @@ class ImageAdmin(MediaAdminBase):
         admin_actions.assign_category,
         'change_is_public_action',
         admin_actions.add_images_to_gallery,
+        admin_actions.download_zip,
+        admin_actions.make_zip_action(
+            'lightbox_image', _("Download as zip (web size)")),
     ]
 
 
@@ -177,6 +207,7 @@ class DownloadAdmin(MediaAdminBase):
     actions = [
         admin_actions.assign_category,
         'change_is_public_action',
+        admin_actions.download_zip,
     ]
 
 
@@ -196,7 +227,7 @@ class ImageGalleryRelInline(admin.TabularInline):
 
 
 @admin.register(models.Gallery)
-class GalleryAdmin(admin.ModelAdmin):
+class GalleryAdmin(SearchDocumentAdminMixin, admin.ModelAdmin):
     list_display = ('is_public', 'name', 'get_image_count')
     list_display_links = ['name']
     list_filter = ['is_public']
@@ -230,8 +261,51 @@ class GalleryAdmin(admin.ModelAdmin):
     }
 
     inlines = [ImageGalleryRelInline]
+    actions = [admin_actions.download_zip]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_image_stats()
+
+    def get_urls(self):
+        from django.conf.urls import url
+
+        return [
+            url(
+                r"^(?P<object_id>\d+)/reorder/$",
+                self.admin_site.admin_view(self.reorder_images),
+                name="media_archive_gallery_reorder",
+            ),
+        ] + super().get_urls()
+
+    def reorder_images(self, request, object_id):
+        """
+        Order the images of a gallery like the ``rel`` ids POSTed, either
+        as repeated form values or as a JSON list.
+        """
+        if request.method != 'POST':
+            return HttpResponseNotAllowed(['POST'])
+        gallery = self.get_object(request, object_id)
+        if gallery is None or not self.has_change_permission(request, gallery):
+            raise PermissionDenied
+
+        if request.content_type == 'application/json':
+            try:
+                rel_ids = json.loads(request.body.decode())['rel']
+            except (ValueError, KeyError, TypeError):
+                rel_ids = None
+        else:
+            rel_ids = request.POST.getlist('rel')
+        if not isinstance(rel_ids, list) or not all(is_id(pk) for pk in rel_ids):
+            return JsonResponse(
+                {"success": False, "error": "rel must be a list of ids."}, status=400)
+        try:
+            count = models.ImageGalleryRel.objects.reorder(gallery, rel_ids)
+        except ValueError as e:
+            return JsonResponse({"success": False, "error": str(e)}, status=400)
+        return JsonResponse({"success": True, "count": count})
 
     def get_image_count(self, obj):
-        return obj.images.count()
+        return obj.image_count
     get_image_count.short_description = _("Bilder")
+    get_image_count.admin_order_field = 'image_count'
 
@@ -1,11 +1,18 @@
 from django import forms
 from django.contrib import admin
+from django.db import transaction
 from django.http import HttpResponseRedirect
 from django.utils.translation import ngettext, gettext_lazy as _
 from django.shortcuts import render
 
 from shared.utils.admin_actions import AdminActionBase, TargetActionBase
 from . import models
+from .exports import zip_response
+
+
+def unique_pks(queryset):
+    # Default orderings may span relations and yield duplicate rows.
+    return list(dict.fromkeys(queryset.values_list('pk', flat=True)))
 
 
 class AddImagesToGalleryAction(TargetActionBase):
@@ -16,17 +23,29 @@ class AddImagesToGalleryAction(TargetActionBase):
     queryset_action_label = _("The selected images will be added to the following gallery:")
     action_button_label = _("Add Images")
 
+    batch_size = 500
+
     def apply(self, queryset, form):
         gallery = self.get_target(form)
-        count = 0
-        for image in queryset:
-            _, created = \
-                models.ImageGalleryRel.objects.get_or_create(
-                    image=image,
-                    gallery=gallery)
-            if created:
-                count += 1
-        return count
+        rels = models.ImageGalleryRel.objects.filter(gallery=gallery)
+        existing = set(rels.values_list('image_id', flat=True))
+        image_ids = [
+            pk for pk in unique_pks(queryset)
+            if pk not in existing]
+        if not image_ids:
+            return 0
+
+        # New images are appended after the current last position.
+        position = models.ImageGalleryRel.objects.next_position(gallery)
+        gap = models.ImageGalleryRel.POSITION_GAP
+        with transaction.atomic():
+            models.ImageGalleryRel.objects.bulk_create([
+                models.ImageGalleryRel(
+                    image_id=pk, gallery=gallery, position=position + i * gap)
+                for i, pk in enumerate(image_ids)
+            ], batch_size=self.batch_size)
+            models.Gallery.objects.filter(pk=gallery.pk).bump_version()
+        return len(image_ids)
 
 
 add_images_to_gallery = AddImagesToGalleryAction('add_images_to_gallery')
@@ -41,18 +60,46 @@ class AssignCategoryAction(TargetActionBase):
     queryset_action_label = _("Images which will be assigned to the chosen category:")
     action_button_label = _("Add Images")
 
+    batch_size = 500
+
     def apply(self, queryset, form):
         category = self.get_target(form)
-        count = 0
-        for mediafile in queryset:
-            getattr(mediafile, self.related_field_name).add(category)
-            count += 1
-        return count
+        return queryset.model.objects.add_categories(
+            unique_pks(queryset), [category], batch_size=self.batch_size)
 
 
 assign_category = AssignCategoryAction('assign_category')
 
 
+def make_zip_action(spec=None, description=None):
+    """
+    Admin action streaming a zip of the selected media, of the images of
+    selected galleries or of the media in selected working folders.
+    """
+    def download_zip(modeladmin, request, queryset):
+        model = queryset.model
+        if model is models.Gallery:
+            objects = models.Image.objects.filter(
+                imagegalleryrel__gallery__in=queryset).order_by(
+                'imagegalleryrel__gallery', 'imagegalleryrel__position')
+        elif model is models.MediaCategory:
+            objects = (
+                obj for media_model in models.media_models()
+                # Without the default ordering's gallery join, distinct()
+                # removes the duplicates of media in several folders.
+                for obj in media_model.objects.filter(
+                    categories__in=queryset).order_by('pk').distinct().iterator())
+        else:
+            objects = queryset.iterator()
+        return zip_response(objects, '%s.zip' % model._meta.model_name, spec)
+    download_zip.__name__ = 'download_zip_%s' % (spec or 'originals')
+    download_zip.short_description = description or _("Download as zip")
+    return download_zip
+
+
+download_zip = make_zip_action()
+
+
 class MediaBaseActionsMixin:
     def change_is_public_action(self, request, queryset):
         modeladmin = self
@@ -73,6 +120,10 @@ class MediaBaseActionsMixin:
             if form.is_valid():
                 chosen_is_public = form.cleaned_data['is_public']
                 count = queryset.update(is_public=chosen_is_public)
+                if queryset.model is models.Image:
+                    # update() sends no signals, the galleries' public
+                    # images changed nevertheless.
+                    models.Gallery.objects.filter(images__in=queryset).bump_version()
                 message = ngettext(
                     'Successfully set %(count)d media file to %(chosen_is_public)s.',
                     'Successfully set %(count)d media files to %(chosen_is_public)s.',
@@ -1,7 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 from django.utils.translation import gettext_lazy as _
 
 
 class MediaArchiveConfig(AppConfig):
     name = 'shared.media_archive'
     verbose_name = _("Digital Media File Archive")
+
+    def ready(self):
+        from . import signals  # noqa
+        from .models import create_public_index_fallbacks
+        from .search import create_search_indexes
+
+        post_migrate.connect(create_search_indexes, sender=self)
+        post_migrate.connect(create_public_index_fallbacks, sender=self)
@@ -0,0 +1,63 @@
+from django import VERSION as DJANGO_VERSION
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from .conf import CATEGORY_FILTER_CACHE_TIMEOUT, PRECOMPUTE_CATEGORY_FILTER
+
+
+def category_filter_fields(model):
+    return [
+        f for f in model._meta.get_fields()
+        if getattr(f, 'category_filter', False)
+    ]
+
+
+def category_filter_cache_key(field):
+    return 'media_archive:category_filter:%s.%s' % (
+        field.model._meta.label_lower, field.name)
+
+
+def compute_category_filter_choices(field):
+    """
+    Sorted ``(pk, "title (count)")`` choices of all categories which are
+    actually in use.
+    """
+    if DJANGO_VERSION < (2, 0):
+        related_model = field.rel.to
+    else:
+        related_model = field.remote_field.model
+    related_name = field.related_query_name()
+
+    return sorted(
+        [
+            (i.pk, '%s (%s)' % (i, i._related_count))
+            for i in related_model.objects.annotate(
+                _related_count=Count(related_name)
+            ).exclude(_related_count=0)
+        ],
+        key=lambda i: i[1],
+    )
+
+
+def get_category_filter_choices(field):
+    key = category_filter_cache_key(field)
+    choices = cache.get(key)
+    if choices is None:
+        choices = compute_category_filter_choices(field)
+        cache.set(key, choices, CATEGORY_FILTER_CACHE_TIMEOUT)
+    return choices
+
+
+def refresh_category_filter_choices(field):
+    cache.delete(category_filter_cache_key(field))
+    if PRECOMPUTE_CATEGORY_FILTER:
+        get_category_filter_choices(field)
+
+
+def invalidate_category_filter_choices(model):
+    # Deleting before the commit would let concurrent requests cache the
+    # old choices again, without a timeout for good.
+    for field in category_filter_fields(model):
+        transaction.on_commit(
+            lambda field=field: refresh_category_filter_choices(field))
@@ -7,3 +7,41 @@ USE_TRANSLATABLE_FIELDS = (
 
 
 UPLOAD_TO = getattr(settings, 'MEDIARCHIVE_UPLOAD_TO', 'archive')
+
+
+# Seconds the choices of the category list filter are cached, None caches
+# until the category assignments change.
+CATEGORY_FILTER_CACHE_TIMEOUT = getattr(settings, 'MEDIARCHIVE_CATEGORY_FILTER_CACHE_TIMEOUT', None)
+
+# Recompute the category filter choices right after a change instead of
+# on the next changelist request.
+PRECOMPUTE_CATEGORY_FILTER = getattr(settings, 'MEDIARCHIVE_PRECOMPUTE_CATEGORY_FILTER', False)
+
+# Directory for partially uploaded files of the resumable chunked upload,
+# should be on the same filesystem as the media storage.
+UPLOAD_CHUNK_DIR = getattr(settings, 'MEDIARCHIVE_UPLOAD_CHUNK_DIR', None)
+
+# Seconds after which abandoned partial uploads are removed.
+UPLOAD_CHUNK_MAX_AGE = getattr(settings, 'MEDIARCHIVE_UPLOAD_CHUNK_MAX_AGE', 24 * 60 * 60)
+
+# Reuse the stored file of an existing record with identical contents
+# (same SHA-256 digest) instead of writing a new file on upload.
+DEDUPLICATE_FILES = getattr(settings, 'MEDIARCHIVE_DEDUPLICATE_FILES', False)
+
+# Render all image spec renditions right after an image was uploaded.
+PREGENERATE_ON_UPLOAD = getattr(settings, 'MEDIARCHIVE_PREGENERATE_ON_UPLOAD', False)
+
+# Background threads rendering uploaded images, and the default number of
+# worker processes of `manage.py pregenerate_renditions`; 0 renders
+# synchronously in the current process.
+PREGENERATE_WORKERS = getattr(settings, 'MEDIARCHIVE_PREGENERATE_WORKERS', 0)
+
+# Determine the type of uploaded downloads from their leading bytes too,
+# not only from the file name extension.
+SNIFF_FILE_TYPES = getattr(settings, 'MEDIARCHIVE_SNIFF_FILE_TYPES', False)
+
+# Storage directory of responsive rendition sets (see Image.rendition_sets).
+RENDITION_SET_DIR = getattr(settings, 'MEDIARCHIVE_RENDITION_SET_DIR', 'CACHE/sets')
+
+# Seconds JSON API responses are cached, entries are keyed by their ETag.
+API_CACHE_TIMEOUT = getattr(settings, 'MEDIARCHIVE_API_CACHE_TIMEOUT', 60 * 60)
@@ -0,0 +1,154 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from imagekit.cachefiles.backends import CacheFileState
+
+from .models import PendingFileDeletion
+from .renditions import image_spec_names, rendition_set_directory
+
+
+logger = logging.getLogger(__name__)
+
+
+def rendition_files(model, name):
+    """
+    Cached image spec files generated from the source file ``name``.
+    """
+    spec_names = image_spec_names(model)
+    if not spec_names:
+        return []
+    instance = model(file=name)
+    return [getattr(instance, spec_name) for spec_name in spec_names]
+
+
+def rendition_set_files(model, storage, name):
+    """
+    Stored files of the rendition sets (see Image.rendition_sets) of the
+    source file ``name``.
+    """
+    if not getattr(model, 'rendition_sets', None):
+        return []
+    directory = rendition_set_directory(name)
+    try:
+        dirs, files = storage.listdir(directory)
+    except (OSError, IOError, NotImplementedError):
+        return []
+    return ['%s/%s' % (directory, f) for f in files]
+
+
+def delete_files(storage, names, workers):
+    """
+    Delete ``names`` from ``storage``, using the storage's ``delete_many``
+    if it has one. Returns a dict of names which could not be deleted.
+    """
+    errors = {}
+    delete_many = getattr(storage, 'delete_many', None)
+    if delete_many is not None:
+        try:
+            delete_many(names)
+            return errors
+        except Exception as e:
+            logger.warning("Bulk delete failed, deleting one by one: %s" % e)
+
+    def delete(name):
+        try:
+            storage.delete(name)
+        except Exception as e:
+            errors[name] = str(e)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(delete, names))
+    return errors
+
+
+def claim_pending_deletions(batch_size, max_attempts, claim_timeout):
+    """
+    Mark a batch of queue entries as being processed, in a short
+    transaction of its own. Claims of crashed runs expire after
+    ``claim_timeout`` seconds.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        entries = list(
+            PendingFileDeletion.objects.select_for_update(skip_locked=True)
+            .filter(attempts__lt=max_attempts)
+            .filter(Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))[:batch_size])
+        PendingFileDeletion.objects.filter(pk__in=[e.pk for e in entries]).update(
+            claimed_until=now + timedelta(seconds=claim_timeout))
+    return entries
+
+
+def process_pending_deletions(batch_size=100, workers=8, max_attempts=5, claim_timeout=3600):
+    """
+    Delete one batch of queued files including their cached renditions.
+    Files still referenced by a record (e.g. deduplicated ones) are kept.
+    The entries are claimed first, no locks are held while the storage
+    deletes run.
+
+    Returns the number of processed queue entries.
+    """
+    entries = claim_pending_deletions(batch_size, max_attempts, claim_timeout)
+    if not entries:
+        return 0
+
+    by_model = {}
+    for entry in entries:
+        by_model.setdefault(entry.model_label, []).append(entry)
+
+    done, failed = [], {}
+    for model_label, model_entries in by_model.items():
+        model = apps.get_model(model_label)
+        storage = model._meta.get_field('file').storage
+        names = [e.name for e in model_entries]
+        referenced = set(model._default_manager.filter(
+            file__in=names).values_list('file', flat=True))
+
+        # Deleting several deduplicated records queues their shared file
+        # more than once.
+        files = {}
+        renditions = []
+        for entry in model_entries:
+            if entry.name in referenced:
+                done.append(entry.pk)
+                continue
+            if entry.name not in files:
+                files[entry.name] = []
+                renditions.extend(rendition_files(model, entry.name))
+            files[entry.name].append(entry)
+
+        set_files = [
+            set_file for name in files
+            for set_file in rendition_set_files(model, storage, name)]
+        errors = delete_files(storage, list(files) + set_files, workers)
+        for name, name_entries in files.items():
+            for entry in name_entries:
+                if name in errors:
+                    failed[entry.pk] = errors[name]
+                else:
+                    done.append(entry.pk)
+
+        # Renditions are regenerated on demand, failures are only logged.
+        rendition_storages = {}
+        for cachefile in renditions:
+            rendition_storages.setdefault(cachefile.storage, []).append(cachefile)
+        for rendition_storage, cachefiles in rendition_storages.items():
+            errors = delete_files(rendition_storage, [c.name for c in cachefiles], workers)
+            for cachefile in cachefiles:
+                set_state = getattr(cachefile.cachefile_backend, 'set_state', None)
+                if set_state is not None:
+                    set_state(cachefile, CacheFileState.DOES_NOT_EXIST)
+            for name, error in errors.items():
+                logger.warning("Cannot delete rendition %s: %s" % (name, error))
+
+    PendingFileDeletion.objects.filter(pk__in=done).delete()
+    for pk, error in failed.items():
+        logger.warning("Cannot delete media file %s: %s" % (pk, error))
+        PendingFileDeletion.objects.filter(pk=pk).update(
+            attempts=F('attempts') + 1, last_error=error, claimed_until=None)
+    return len(entries)
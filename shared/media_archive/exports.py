@@ -0,0 +1,118 @@
+"""
+Zip archives of media files, streamed in constant memory.
+"""
+import posixpath
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.http import StreamingHttpResponse
+
+
+CHUNK_SIZE = 64 * 1024
+
+# Already compressed formats are stored, not deflated again.
+STORED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif', '.mp4', '.m4v', '.mov',
+    '.mp3', '.m4a', '.zip', '.gz', '.pdf', '.docx', '.xlsx', '.pptx',
+}
+
+
+class _StreamBuffer:
+    """
+    Write-only, unseekable file object collecting what ZipFile writes.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _prefetch(opener):
+    f = opener()
+    return f, f.read(CHUNK_SIZE)
+
+
+def stream_zip(entries):
+    """
+    Yield a zip archive of ``(arcname, opener)`` entries, where ``opener``
+    returns a binary file object. The next file is opened and its first
+    chunk read in the background while the current one is sent.
+    """
+    buffer = _StreamBuffer()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with zipfile.ZipFile(buffer, 'w', allowZip64=True) as archive:
+            entries = iter(entries)
+            current = next(entries, None)
+            future = executor.submit(_prefetch, current[1]) if current else None
+            while current is not None:
+                arcname = current[0]
+                f, chunk = future.result()
+                current = next(entries, None)
+                if current is not None:
+                    future = executor.submit(_prefetch, current[1])
+
+                info = zipfile.ZipInfo(arcname)
+                info.compress_type = (
+                    zipfile.ZIP_STORED
+                    if posixpath.splitext(arcname)[1].lower() in STORED_EXTENSIONS
+                    else zipfile.ZIP_DEFLATED)
+                try:
+                    with archive.open(info, 'w', force_zip64=True) as dest:
+                        while chunk:
+                            dest.write(chunk)
+                            yield buffer.pop()
+                            chunk = f.read(CHUNK_SIZE)
+                finally:
+                    f.close()
+                yield buffer.pop()
+        yield buffer.pop()
+
+
+def media_zip_entries(objects, spec=None):
+    """
+    ``(arcname, opener)`` entries of media objects' original files or, for
+    images, of the image spec ``spec``. Names are made unique.
+    """
+    used = set()
+    for obj in objects:
+        if not obj.file:
+            continue
+        storage, name = obj.file.storage, obj.file.name
+        rendition = getattr(obj, spec, None) if spec else None
+        # Animated images may resolve to manifest entries without a storage.
+        if hasattr(rendition, 'storage'):
+            if hasattr(rendition, 'generate'):
+                rendition.generate()
+            storage, name = rendition.storage, rendition.name
+
+        base, ext = posixpath.splitext(posixpath.basename(obj.file.name))
+        ext = posixpath.splitext(name)[1] or ext
+        arcname, counter = base + ext, 1
+        while arcname in used:
+            counter += 1
+            arcname = '%s-%d%s' % (base, counter, ext)
+        used.add(arcname)
+        yield arcname, (lambda storage=storage, name=name: storage.open(name, 'rb'))
+
+
+def zip_response(objects, filename, spec=None):
+    response = StreamingHttpResponse(
+        stream_zip(media_zip_entries(objects, spec)), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
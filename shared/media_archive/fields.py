@@ -0,0 +1,25 @@
+from imagekit.models import ImageSpecField as BaseImageSpecField
+from imagekit.models.fields.utils import ImageSpecFileDescriptor
+
+
+class AnimationAwareImageSpecFileDescriptor(ImageSpecFileDescriptor):
+    def __get__(self, instance, owner):
+        if instance is not None and getattr(instance, 'is_animated', False):
+            rendition = instance.animated_rendition(self.attname)
+            if rendition is not None:
+                return rendition
+        return super().__get__(instance, owner)
+
+
+class ImageSpecField(BaseImageSpecField):
+    """
+    ImageSpecField which asks the model's ``animated_rendition(spec_name)``
+    for animated sources, and renders their first frame only if that
+    returns ``None``.
+    """
+
+    def contribute_to_class(self, cls, name):
+        super().contribute_to_class(cls, name)
+        descriptor = cls.__dict__[name]
+        setattr(cls, name, AnimationAwareImageSpecFileDescriptor(
+            self, name, descriptor.source_field_name))
@@ -0,0 +1,65 @@
+"""
+Content sniffing of file types by their leading bytes.
+"""
+
+SNIFF_BYTES = 4096
+
+
+def _ftyp_type(head):
+    # ISO base media files: the brand distinguishes images and audio.
+    brand = head[8:12]
+    if brand in (b'heic', b'heix', b'hevc', b'mif1', b'msf1', b'avif'):
+        return 'image'
+    if brand in (b'M4A ', b'M4B '):
+        return 'audio'
+    return 'video'
+
+
+MAGIC_NUMBERS = [
+    # (offset, leading bytes, file type or callable receiving the head)
+    (0, b'\xff\xd8\xff', 'image'),
+    (0, b'\x89PNG\r\n\x1a\n', 'image'),
+    (0, b'GIF87a', 'image'),
+    (0, b'GIF89a', 'image'),
+    (0, b'II*\x00', 'image'),
+    (0, b'MM\x00*', 'image'),
+    (0, b'%PDF-', 'pdf'),
+    (0, b'{\\rtf', 'rtf'),
+    (0, b'PK\x03\x04', 'zip'),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'doc'),
+    (0, b'FWS', 'swf'),
+    (0, b'CWS', 'swf'),
+    (0, b'ZWS', 'swf'),
+    (0, b'ID3', 'audio'),
+    (4, b'ftyp', _ftyp_type),
+    (0, b'\x1aE\xdf\xa3', 'video'),
+]
+
+# Sniffed container formats which can't tell their contents apart, the
+# extension decides between these.
+CONTAINER_TYPES = {
+    'zip': {'doc', 'xls', 'ppt'},
+    'doc': {'doc', 'xls', 'ppt'},
+}
+
+
+def sniff_file_type(head):
+    """
+    Return the file type of the leading bytes ``head``, or ``None``.
+    """
+    if head[:4] == b'RIFF':
+        return {b'WAVE': 'audio', b'AVI ': 'video', b'WEBP': 'image'}.get(head[8:12])
+    for offset, magic, file_type in MAGIC_NUMBERS:
+        if head[offset:offset + len(magic)] == magic:
+            return file_type(head) if callable(file_type) else file_type
+    return None
+
+
+def read_head(f, size=SNIFF_BYTES):
+    """
+    Read the first ``size`` bytes of the file ``f`` and rewind it.
+    """
+    f.seek(0)
+    head = f.read(size)
+    f.seek(0)
+    return head
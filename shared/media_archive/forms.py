@@ -11,7 +11,7 @@ class MediaCategoryAdminForm(forms.ModelForm):
 
     def clean_parent(self):
         data = self.cleaned_data['parent']
-        if data is not None and self.instance in data.path_list():
+        if data is not None and self.instance.pk in data.path_ids():
             raise forms.ValidationError(
                 _("This would create a loop in the hierarchy"))
         return data
@@ -0,0 +1,207 @@
+"""
+Bulk import of files from a directory tree or a zip archive.
+
+Files are streamed (hashed and spooled in one pass) and written to the
+storage by a thread pool; rows are created with ``bulk_create`` per batch.
+Folder names become working folders (two levels at most). Imported paths
+are appended to a state file, so an interrupted import can be resumed.
+"""
+import hashlib
+import os
+import posixpath
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files import File
+from django.db import transaction
+from PIL import Image as PILImage
+
+from .conf import SNIFF_FILE_TYPES
+from .filetypes import read_head
+from .models import Download, Image, MediaCategory
+from .renditions import detect_image_format
+
+
+SourceFile = namedtuple('SourceFile', 'path size open')
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.tif', '.tiff', '.webp', '.bmp')
+
+CHUNK_SIZE = 1024 * 1024
+SPOOL_SIZE = 10 * 1024 * 1024
+
+
+def _skip(path):
+    parts = path.split('/')
+    return parts[0] == '__MACOSX' or any(p.startswith('.') for p in parts)
+
+
+def iter_directory(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            full_path = os.path.join(dirpath, filename)
+            path = os.path.relpath(full_path, root).replace(os.sep, '/')
+            if not _skip(path):
+                yield SourceFile(
+                    path, os.path.getsize(full_path),
+                    lambda full_path=full_path: open(full_path, 'rb'))
+
+
+def iter_zip(archive):
+    for info in archive.infolist():
+        if info.filename.endswith('/') or _skip(info.filename):
+            continue
+        yield SourceFile(info.filename, info.file_size, lambda info=info: archive.open(info))
+
+
+def default_model_for(path):
+    return Image if path.lower().endswith(IMAGE_EXTENSIONS) else Download
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class MediaImporter:
+    def __init__(self, model_for=default_model_for, workers=8, batch_size=200,
+                 state_path=None, assign_categories=True, is_public=True, log=None):
+        self.model_for = model_for
+        self.workers = workers
+        self.batch_size = batch_size
+        self.state_path = state_path
+        self.assign_categories = assign_categories
+        self.is_public = is_public
+        self.log = log or (lambda message: None)
+        self.categories = {}
+        self.files = self.bytes = self.errors = 0
+
+    def load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return set()
+        with open(self.state_path, encoding='utf-8') as f:
+            return set(line.rstrip('\n') for line in f)
+
+    def save_state(self, paths):
+        if self.state_path:
+            with open(self.state_path, 'a', encoding='utf-8') as f:
+                f.writelines('%s\n' % p for p in paths)
+
+    def run(self, sources):
+        done = self.load_state()
+        if done:
+            self.log("Resuming, skipping %d imported files." % len(done))
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = (s for s in sources if s.path not in done)
+            for batch in batches(pending, self.batch_size):
+                rows = [row for row in executor.map(self.store, batch) if row]
+                self.flush(rows)
+                self.save_state(row['path'] for row in rows)
+                seconds = time.monotonic() - start
+                self.log("%d files, %.1f files/s, %.1f MB/s" % (
+                    self.files, self.files / (seconds or 1),
+                    self.bytes / 1024 / 1024 / (seconds or 1)))
+        return self.files
+
+    def store(self, source):
+        """
+        Hash, inspect and save one file to the storage; runs in the pool.
+        """
+        model = self.model_for(source.path)
+        field = model._meta.get_field('file')
+        name = posixpath.basename(source.path)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with source.open() as fh, tempfile.SpooledTemporaryFile(SPOOL_SIZE) as spooled:
+                for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    spooled.write(chunk)
+                    size += len(chunk)
+
+                row = {}
+                if SNIFF_FILE_TYPES and hasattr(model, 'determine_file_type'):
+                    row['type'] = model().determine_file_type(name, read_head(spooled))
+                if issubclass(model, Image):
+                    row['image_format'], row['is_animated'] = detect_image_format(spooled)
+                    row['image_width'], row['image_height'] = PILImage.open(spooled).size
+                spooled.seek(0)
+                row['file'] = field.storage.save(
+                    field.generate_filename(model(), name), File(spooled, name=name))
+        except Exception as e:
+            self.errors += 1
+            self.log("Unable to import %s: %s" % (source.path, e))
+            return None
+
+        row.update(model=model, path=source.path, file_size=size,
+                   content_hash=digest.hexdigest())
+        return row
+
+    def category_for(self, folders):
+        """
+        Working folder of a folder path, creating missing parents. Working
+        folders only have two levels, deeper folders are joined into the
+        name of the second level (``a/b/c`` becomes ``b/c`` below ``a``).
+        """
+        if not folders:
+            return None
+        if len(folders) > 2:
+            folders = (folders[0], '/'.join(folders[1:])[:200])
+        if folders not in self.categories:
+            parent = self.category_for(folders[:-1])
+            category = MediaCategory.objects.filter(
+                name=folders[-1], parent=parent).first()
+            if category is None:
+                category = MediaCategory(name=folders[-1], parent=parent)
+                category.save()
+            self.categories[folders] = category
+        return self.categories[folders]
+
+    def build_objects(self, rows):
+        objs = []
+        for row in rows:
+            data = dict(row)
+            model = data.pop('model')
+            data.pop('path')
+            obj = model(is_public=self.is_public, **data)
+            if hasattr(obj, 'determine_file_type') and 'type' not in data:
+                obj.type = obj.determine_file_type(obj.file.name)
+            obj.search_text = obj.build_search_document()
+            objs.append(obj)
+        return objs
+
+    def flush(self, rows):
+        by_model = {}
+        for row in rows:
+            by_model.setdefault(row['model'], []).append(row)
+
+        with transaction.atomic():
+            for model, model_rows in by_model.items():
+                objs = self.build_objects(model_rows)
+                model._default_manager.assign_slugs(objs)
+                model._default_manager.bulk_create(objs)
+
+                names = [obj.file.name for obj in objs]
+                pks = dict(model._default_manager.filter(
+                    file__in=names).values_list('file', 'pk'))
+                if self.assign_categories:
+                    by_category = {}
+                    for row in model_rows:
+                        folders = tuple(row['path'].split('/')[:-1])
+                        category = self.category_for(folders)
+                        if category is not None and row['file'] in pks:
+                            by_category.setdefault(category, []).append(pks[row['file']])
+                    for category, category_pks in by_category.items():
+                        model._default_manager.add_categories(category_pks, [category])
+
+        self.files += len(rows)
+        self.bytes += sum(row['file_size'] for row in rows)
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from shared.media_archive.models import Download, Image, file_digest
+
+
+class Command(BaseCommand):
+    help = "Compute missing content hashes of media files and report duplicates."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+            help="Recompute hashes of all files, not only missing ones.")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        for model in (Image, Download):
+            self.backfill(model, options['all'], options['batch_size'])
+            self.report_duplicates(model)
+
+    def backfill(self, model, recompute, batch_size):
+        queryset = model._default_manager.exclude(file='').order_by('pk')
+        if not recompute:
+            queryset = queryset.filter(content_hash='')
+
+        count = 0
+        last_pk = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk).only('pk', 'file')[:batch_size])
+            if not batch:
+                break
+            for obj in batch:
+                last_pk = obj.pk
+                try:
+                    obj.file.open('rb')
+                    try:
+                        content_hash, file_size = file_digest(obj.file)
+                    finally:
+                        obj.file.close()
+                except (OSError, IOError, ValueError) as e:
+                    self.stderr.write("Unable to read %s: %s" % (obj.file.name, e))
+                    continue
+                model._default_manager.update_derived_fields(
+                    obj.pk, content_hash=content_hash, file_size=file_size)
+                count += 1
+        self.stdout.write("%s: hashed %d files." % (model._meta.verbose_name_plural, count))
+
+    def report_duplicates(self, model):
+        groups = model._default_manager.exclude(content_hash='').values(
+            'content_hash').annotate(n=Count('pk')).filter(n__gt=1).order_by('-n')
+        for group in groups.iterator():
+            pks = model._default_manager.filter(
+                content_hash=group['content_hash']).values_list('pk', flat=True)
+            self.stdout.write("%s %s: %d duplicates (%s)" % (
+                model._meta.verbose_name, group['content_hash'], group['n'],
+                ', '.join(str(pk) for pk in pks)))
@@ -0,0 +1,56 @@
+import os
+import time
+
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from shared.media_archive.models import Image
+from shared.media_archive.renditions import image_spec_names, render_specs
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.tif', '.tiff', '.webp')
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare rendering all image specs of the images in a directory "
+        "per spec (one decode each) against the single-decode pipeline. "
+        "Nothing is written to the storage.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--spec', action='append', dest='specs',
+            help="Only render this spec, may be given multiple times.")
+
+    def handle(self, directory, **options):
+        if not os.path.isdir(directory):
+            raise CommandError("%s is not a directory." % directory)
+        spec_names = options['specs'] or image_spec_names(Image)
+        paths = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.lower().endswith(IMAGE_EXTENSIONS))
+        if not paths:
+            raise CommandError("No images found in %s." % directory)
+
+        per_spec = single_decode = 0.0
+        for path in paths:
+            with open(path, 'rb') as fh:
+                source = File(fh, name=path)
+                generators = {
+                    name: getattr(Image, name).get_spec(source=source)
+                    for name in spec_names}
+
+                start = time.perf_counter()
+                for generator in generators.values():
+                    generator.generate()
+                per_spec += time.perf_counter() - start
+
+                start = time.perf_counter()
+                render_specs(source, generators)
+                single_decode += time.perf_counter() - start
+
+        self.stdout.write("%d images, %d specs" % (len(paths), len(spec_names)))
+        self.stdout.write("per spec:      %.2fs (%.1f images/s)" % (per_spec, len(paths) / per_spec))
+        self.stdout.write("single decode: %.2fs (%.1f images/s)" % (
+            single_decode, len(paths) / single_decode))
+        self.stdout.write("speedup:       %.2fx" % (per_spec / single_decode))
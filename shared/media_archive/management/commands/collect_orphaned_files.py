@@ -0,0 +1,102 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import chain, islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from shared.media_archive.deletions import delete_files
+from shared.media_archive.models import media_models
+from shared.media_archive.orphans import (
+    unreferenced_files, unreferenced_renditions, upload_root)
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = "Delete files in the media archive storage which no record references."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+            help="Only report orphaned files and reclaimable bytes.")
+        parser.add_argument('--renditions', action='store_true',
+            help="Also collect stale cached image renditions.")
+        parser.add_argument('--min-age', type=float, default=24,
+            help="Keep files modified within this many hours (uploads in progress).")
+        parser.add_argument('--workers', type=int, default=8,
+            help="Number of concurrent storage requests.")
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--root',
+            help="Storage directory to scan, defaults to the static part of "
+                 "MEDIARCHIVE_UPLOAD_TO. Required if that has none.")
+
+    def handle(self, *args, **options):
+        self.cutoff = timezone.now() - timedelta(hours=options['min_age'])
+        self.options = options
+        self.files = self.bytes = 0
+        root = options['root'] if options['root'] is not None else upload_root()
+        if not root.strip('/'):
+            raise CommandError(
+                "MEDIARCHIVE_UPLOAD_TO has no static upload directory, refusing "
+                "to scan the whole storage. Pass --root.")
+
+        storages = []
+        for model in media_models():
+            storage = model._meta.get_field('file').storage
+            if not any(s is storage for s in storages):
+                storages.append(storage)
+        candidates = chain.from_iterable(
+            ((storage, name) for name in unreferenced_files(storage, root))
+            for storage in storages)
+        if options['renditions']:
+            candidates = chain(candidates, unreferenced_renditions())
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            try:
+                for batch in batches(candidates, options['batch_size']):
+                    self.process(executor, batch)
+            except ValueError as e:
+                raise CommandError("%s, stopping." % e)
+
+        self.stdout.write("%s %d orphaned files, %.1f MB." % (
+            "Found" if options['dry_run'] else "Deleted",
+            self.files, self.bytes / 1024 / 1024))
+
+    def stat(self, item):
+        storage, name = item
+        try:
+            if self.options['min_age'] and storage.get_modified_time(name) > self.cutoff:
+                return None
+            return storage, name, storage.size(name)
+        except (OSError, IOError, NotImplementedError) as e:
+            self.stderr.write("Unable to stat %s: %s" % (name, e))
+            return None
+
+    def process(self, executor, batch):
+        orphans = {}
+        for result in executor.map(self.stat, batch):
+            if result is None:
+                continue
+            storage, name, size = result
+            orphans.setdefault(storage, []).append((name, size))
+            if self.options['verbosity'] > 1:
+                self.stdout.write(name)
+
+        for storage, files in orphans.items():
+            errors = {}
+            if not self.options['dry_run']:
+                errors = delete_files(
+                    storage, [name for name, size in files], self.options['workers'])
+            for name, size in files:
+                if name in errors:
+                    self.stderr.write("Cannot delete %s: %s" % (name, errors[name]))
+                    continue
+                self.files += 1
+                self.bytes += size
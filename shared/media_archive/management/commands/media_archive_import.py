@@ -0,0 +1,53 @@
+import os
+import zipfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shared.media_archive.importer import (
+    MediaImporter, default_model_for, iter_directory, iter_zip)
+from shared.media_archive.models import Download, Image
+
+
+class Command(BaseCommand):
+    help = (
+        "Import all files of a directory tree or zip archive into the media "
+        "archive; folder names become working folders.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="Directory or zip file.")
+        parser.add_argument('--model', choices=['auto', 'image', 'download'], default='auto',
+            help="Import as images, downloads or decide by file extension.")
+        parser.add_argument('--workers', type=int, default=8,
+            help="Number of concurrent storage writes.")
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--state',
+            help="State file of imported paths, defaults to <source>.import-state.")
+        parser.add_argument('--no-categories', action='store_true',
+            help="Don't assign working folders from folder names.")
+        parser.add_argument('--private', action='store_true',
+            help="Import as not public.")
+
+    def handle(self, source, **options):
+        source = source.rstrip('/')
+        model_for = {
+            'auto': default_model_for,
+            'image': lambda path: Image,
+            'download': lambda path: Download,
+        }[options['model']]
+        importer = MediaImporter(
+            model_for=model_for,
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            state_path=options['state'] or '%s.import-state' % source,
+            assign_categories=not options['no_categories'],
+            is_public=not options['private'],
+            log=self.stdout.write)
+
+        if os.path.isdir(source):
+            count = importer.run(iter_directory(source))
+        elif zipfile.is_zipfile(source):
+            with zipfile.ZipFile(source) as archive:
+                count = importer.run(iter_zip(archive))
+        else:
+            raise CommandError("%s is neither a directory nor a zip file." % source)
+        self.stdout.write("Imported %d files, %d errors." % (count, importer.errors))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from shared.media_archive.conf import PREGENERATE_WORKERS
+from shared.media_archive.models import Image
+from shared.media_archive.renditions import image_spec_names, pregenerate
+
+
+class Command(BaseCommand):
+    help = "Generate all image spec renditions which do not exist yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=PREGENERATE_WORKERS,
+            help="Number of worker processes, 0 renders in this process.")
+        parser.add_argument('--spec', action='append', dest='specs',
+            help="Only generate this spec, may be given multiple times.")
+        parser.add_argument('--force', action='store_true',
+            help="Regenerate existing renditions.")
+        parser.add_argument('--public', action='store_true',
+            help="Only public images.")
+        parser.add_argument('--since',
+            help="Only images modified since this date (YYYY-MM-DD).")
+
+    def handle(self, *args, **options):
+        specs = options['specs'] or image_spec_names(Image)
+        queryset = Image.objects.public_objects() if options['public'] else Image.objects.all()
+        queryset = queryset.exclude(file='')
+        if options['since']:
+            queryset = queryset.filter(modified__date__gte=options['since'])
+
+        total = queryset.count()
+        verbosity = options['verbosity']
+
+        def progress(stats):
+            if verbosity > 1 or stats['images'] == total or not stats['images'] % 100:
+                self.stdout.write("%(images)d/%(total)d images, %(rate).1f images/s" % {
+                    'images': stats['images'], 'total': total,
+                    'rate': stats['images'] / (stats['seconds'] or 1),
+                })
+
+        stats = pregenerate(
+            queryset, specs, workers=options['workers'], force=options['force'],
+            callback=progress)
+        self.stdout.write(
+            "Generated %(generated)d, skipped %(skipped)d renditions of %(images)d images "
+            "with %(errors)d errors in %(seconds).1fs." % stats)
+        if stats['seconds']:
+            self.stdout.write("%.1f renditions/s" % (stats['generated'] / stats['seconds']))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shared.media_archive.deletions import process_pending_deletions
+
+
+class Command(BaseCommand):
+    help = "Delete queued media files and their cached renditions from the storage."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=8,
+            help="Number of concurrent storage requests.")
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('--claim-timeout', type=int, default=3600,
+            help="Seconds after which entries claimed by a crashed run are retried.")
+        parser.add_argument('--forever', action='store_true',
+            help="Keep running and poll the queue.")
+        parser.add_argument('--interval', type=float, default=30,
+            help="Seconds between polls with --forever.")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = process_pending_deletions(
+                batch_size=options['batch_size'], workers=options['workers'],
+                max_attempts=options['max_attempts'],
+                claim_timeout=options['claim_timeout'])
+            total += processed
+            if processed:
+                continue
+            if not options['forever']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write("Processed %d queued deletions." % total)
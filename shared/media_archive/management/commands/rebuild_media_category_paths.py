@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shared.media_archive.models import MediaCategory
+
+
+class Command(BaseCommand):
+    help = "Rebuild the stored materialized paths of all media categories."
+
+    def handle(self, *args, **options):
+        parents = dict(MediaCategory.objects.values_list('pk', 'parent_id'))
+        current = dict(MediaCategory.objects.values_list('pk', 'tree_path'))
+        sep = MediaCategory.TREE_PATH_SEPARATOR
+        paths = {}
+
+        def build(pk, seen=()):
+            if pk in paths:
+                return paths[pk]
+            parent_id = parents[pk]
+            if parent_id is None or parent_id in seen:
+                prefix = ''
+            else:
+                prefix = build(parent_id, seen + (pk,))
+            paths[pk] = '%s%s%s' % (prefix, pk, sep)
+            return paths[pk]
+
+        changed = 0
+        with transaction.atomic():
+            for pk in parents:
+                tree_path = build(pk)
+                if current[pk] != tree_path:
+                    MediaCategory.objects.filter(pk=pk).update(tree_path=tree_path)
+                    changed += 1
+
+        self.stdout.write("Rebuilt %d of %d category paths." % (changed, len(parents)))
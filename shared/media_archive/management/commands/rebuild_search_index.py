@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from shared.media_archive.models import Gallery, media_models
+from shared.media_archive.search import rebuild_fts_table
+
+
+class Command(BaseCommand):
+    help = "Rebuild the search documents of all media and galleries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model in media_models() + [Gallery]:
+            count = 0
+            last_pk = 0
+            manager = model._default_manager
+            while True:
+                batch = list(manager.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                for obj in batch:
+                    text = obj.build_search_document()
+                    if text != obj.search_text:
+                        manager.update_derived_fields(obj.pk, search_text=text)
+                        count += 1
+            rebuild_fts_table(model)
+            self.stdout.write("%s: updated %d search documents." % (
+                model._meta.verbose_name_plural, count))
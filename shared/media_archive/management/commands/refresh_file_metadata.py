@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from shared.media_archive.models import Download, Image
+from shared.media_archive.renditions import detect_image_format
+
+
+class Command(BaseCommand):
+    help = "Re-read the file sizes of media files from the storage."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing', action='store_true',
+            help="Only files without a stored size.")
+        parser.add_argument('--workers', type=int, default=8,
+            help="Number of concurrent storage requests.")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--image-formats', action='store_true',
+            help="Also detect the format and animation of images without one.")
+
+    def handle(self, *args, **options):
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for model in (Image, Download):
+                self.refresh(model, executor, options)
+            if options['image_formats']:
+                self.refresh_image_formats(executor, options)
+
+    def refresh_image_formats(self, executor, options):
+        storage = Image._meta.get_field('file').storage
+        queryset = Image._default_manager.exclude(file='').filter(image_format='').order_by('pk')
+
+        def detect(row):
+            pk, name = row
+            try:
+                with storage.open(name, 'rb') as f:
+                    return pk, detect_image_format(f)
+            except (OSError, IOError, ValueError) as e:
+                self.stderr.write("Unable to read %s: %s" % (name, e))
+                return pk, None
+
+        updated = 0
+        last_pk = 0
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).values_list(
+                'pk', 'file')[:options['batch_size']])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            for pk, result in executor.map(detect, rows):
+                if result is not None:
+                    image_format, is_animated = result
+                    Image._default_manager.update_derived_fields(
+                        pk, image_format=image_format, is_animated=is_animated)
+                    updated += 1
+        self.stdout.write("Images: detected %d formats." % updated)
+
+    def refresh(self, model, executor, options):
+        storage = model._meta.get_field('file').storage
+        queryset = model._default_manager.exclude(file='').order_by('pk')
+        if options['missing']:
+            queryset = queryset.filter(file_size__isnull=True)
+
+        def stat(row):
+            pk, name, file_size = row
+            try:
+                return pk, file_size, storage.size(name)
+            except (OSError, IOError, ValueError, NotImplementedError) as e:
+                self.stderr.write("Unable to read size of %s: %s" % (name, e))
+                return pk, file_size, file_size
+
+        checked = updated = 0
+        last_pk = 0
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).values_list(
+                'pk', 'file', 'file_size')[:options['batch_size']])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            checked += len(rows)
+            for pk, old_size, new_size in executor.map(stat, rows):
+                if new_size != old_size:
+                    model._default_manager.update_derived_fields(pk, file_size=new_size)
+                    updated += 1
+        self.stdout.write("%s: checked %d, updated %d." % (
+            model._meta.verbose_name_plural, checked, updated))
@@ -0,0 +1,54 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from shared.media_archive.filetypes import read_head
+from shared.media_archive.models import Download
+
+
+class Command(BaseCommand):
+    help = "Redetermine the file type of all downloads, updating them in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sniff', action='store_true',
+            help="Read the leading bytes of every file to detect its type.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        detector = Download()
+        queryset = Download._default_manager.exclude(file='').order_by('pk')
+        storage = Download._meta.get_field('file').storage
+
+        checked = changed = 0
+        last_pk = 0
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).values_list(
+                'pk', 'file', 'type')[:batch_size])
+            if not rows:
+                break
+            updates = defaultdict(list)
+            for pk, name, current_type in rows:
+                last_pk = pk
+                head = None
+                if options['sniff']:
+                    try:
+                        with storage.open(name, 'rb') as f:
+                            head = read_head(f)
+                    except (OSError, IOError, ValueError) as e:
+                        self.stderr.write("Unable to read %s: %s" % (name, e))
+                new_type = detector.determine_file_type(name, head)
+                if new_type != current_type:
+                    updates[new_type].append(pk)
+            checked += len(rows)
+
+            for new_type, pks in updates.items():
+                changed += len(pks)
+                if options['verbosity'] > 1:
+                    self.stdout.write("%d downloads -> %s" % (len(pks), new_type))
+                if not options['dry_run']:
+                    Download._default_manager.filter(pk__in=pks).update(type=new_type)
+
+        self.stdout.write("Checked %d downloads, %s %d." % (
+            checked, "would change" if options['dry_run'] else "changed", changed))
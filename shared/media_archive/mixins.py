@@ -1,6 +1,41 @@
-import django
-from django.http import JsonResponse
+import json
+import os
+import re
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from django.conf import settings
 from django.core.exceptions import PermissionDenied
+from django.core.files import File
+from django.http import JsonResponse
+
+from .conf import UPLOAD_CHUNK_DIR, UPLOAD_CHUNK_MAX_AGE
+
+
+UPLOAD_ID_RE = re.compile(r'^[0-9A-Za-z_-]{8,64}$')
+
+
+def lock_file(fh):
+    """
+    Exclusive lock on ``fh``, released when it is closed.
+    """
+    if fcntl is not None:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+
+
+class ChunkedUploadFile(File):
+    """
+    Assembled chunked upload; storages which support it (e.g.
+    FileSystemStorage) move the file into place instead of copying it.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
 
 
 class DropUploadAdminMixin:
@@ -10,6 +45,8 @@ class DropUploadAdminMixin:
             "media_archive/js/admin_file_drop.js",
         )
 
+    upload_category_lookup = 'categories__exact'
+
     def get_urls(self):
         from django.conf.urls import url
 
@@ -18,56 +55,185 @@ class DropUploadAdminMixin:
                 r"^upload/$",
                 self.admin_site.admin_view(self.upload),
                 name="media_archive_upload",
-            )
+            ),
+            url(
+                r"^upload/chunk/$",
+                self.admin_site.admin_view(self.upload_chunk),
+                name="media_archive_upload_chunk",
+            ),
+            url(
+                r"^upload/commit/$",
+                self.admin_site.admin_view(self.upload_commit),
+                name="media_archive_upload_commit",
+            ),
         ] + super().get_urls()
 
+    def get_upload_categories(self, request):
+        """
+        Categories for uploaded files, taken from the currently active
+        changelist filter without building a ChangeList.
+        """
+        from .models import MediaCategory
+
+        value = request.GET.get(self.upload_category_lookup)
+        try:
+            pk = int(value)
+        except (TypeError, ValueError):
+            return []
+        return list(MediaCategory.objects.filter(pk=pk))
+
+    def save_uploads(self, request, files):
+        # Put uploaded files in the selected categories
+        categories = self.get_upload_categories(request)
+
+        objs = []
+        for uploaded_file in files:
+            f = self.model()
+            f.file = uploaded_file
+            objs.append(f)
+        self.model.objects.assign_slugs(objs)
+
+        pks = []
+        for f in objs:
+            f.save()
+            pks.append(f.pk)
+
+        if pks and categories:
+            self.model.objects.add_categories(pks, categories)
+        return pks
+
     def upload(self, request):
-        # We must initialize a fake-ChangeList to be able to get the currently
-        # selected categories.
-
-        if django.VERSION >= (2, 0, 0):
-            changelist = self.get_changelist_instance(request)
-
-        else:
-            # Code copied from django.contrib.admin.options.ModelAdmin.changelist_view
-            if not self.has_change_permission(request, None):
-                raise PermissionDenied
-
-            list_display = self.get_list_display(request)
-            list_display_links = self.get_list_display_links(request, list_display)
-            list_filter = self.get_list_filter(request)
-            search_fields = self.get_search_fields(request)
-            list_select_related = self.get_list_select_related(request)
-
-            # Check actions to see if any are available on this changelist
-            actions = self.get_actions(request)
-            if actions:
-                # Add the action checkboxes if there are any actions available.
-                list_display = ['action_checkbox'] + list(list_display)
-
-            ChangeList = self.get_changelist(request)
-            changelist = ChangeList(
-                request, self.model, list_display,
-                list_display_links, list_filter, self.date_hierarchy,
-                search_fields, list_select_related, self.list_per_page,
-                self.list_max_show_all, self.list_editable, self,
-            )
-
-        # Put uploaded file in selected categories
-        if changelist.result_list:
-            filtered_categories = changelist.result_list.first().categories.all()
-        elif 'categories__exact' in changelist.params:
-            from .models import MediaCategory
-            filtered_categories = MediaCategory.objects.filter(
-                categories__exact=int(changelist.params['categories__exact']))
-        else:
-            filtered_categories = None
-
-        f = self.model()
-        f.file = request.FILES["file"]
-        f.save()
-
-        if filtered_categories:
-            for cat in filtered_categories:
-                f.categories.add(cat)
-        return JsonResponse({"success": True})
+        if request.method != 'POST' or not self.has_add_permission(request):
+            raise PermissionDenied
+
+        pks = self.save_uploads(request, request.FILES.getlist("file"))
+        return JsonResponse({"success": True, "count": len(pks)})
+
+    #
+    # Resumable chunked uploads
+    #
+    # GET  upload/chunk/?upload_id=<id>     -> {"offset": <bytes received>}
+    # POST upload/chunk/ upload_id, offset, chunk
+    #                                       -> {"offset": <bytes received>}
+    # POST upload/commit/ upload_id, name, size
+    #                                       -> {"success": true}
+    #
+    # Chunks are appended to a temporary file which is moved into the
+    # storage on commit. A chunk with an unexpected offset is rejected with
+    # status 409 and the current offset, so clients can resume. Appends and
+    # commits hold an exclusive lock on the part file. Committed uploads
+    # leave a small result file, so repeating a commit whose response was
+    # lost returns the first result instead of creating a second record.
+    # Upload ids must therefore be unique per upload, not per file: the
+    # drop script creates a random id for every dropped file.
+    # Part and result files older than UPLOAD_CHUNK_MAX_AGE are removed.
+
+    def get_upload_chunk_directory(self):
+        directory = os.path.join(
+            UPLOAD_CHUNK_DIR or getattr(settings, 'FILE_UPLOAD_TEMP_DIR', None) or tempfile.gettempdir(),
+            'media_archive_uploads')
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def get_upload_chunk_path(self, request, upload_id):
+        if not UPLOAD_ID_RE.match(upload_id or ''):
+            return None
+        return os.path.join(
+            self.get_upload_chunk_directory(),
+            '%s-%s.part' % (request.user.pk, upload_id))
+
+    def sweep_upload_chunks(self):
+        """
+        Remove abandoned part files and old commit results.
+        """
+        directory = self.get_upload_chunk_directory()
+        expired = time.time() - UPLOAD_CHUNK_MAX_AGE
+        for name in os.listdir(directory):
+            if not name.endswith(('.part', '.done')):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                if os.path.getmtime(path) < expired:
+                    os.remove(path)
+            except OSError:
+                pass  # Removed concurrently
+
+    def read_upload_result(self, path):
+        try:
+            with open(path[:-len('.part')] + '.done') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def upload_chunk(self, request):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+
+        data = request.POST if request.method == 'POST' else request.GET
+        path = self.get_upload_chunk_path(request, data.get('upload_id'))
+        if path is None:
+            return JsonResponse({"success": False, "error": "Invalid upload id."}, status=400)
+        result = self.read_upload_result(path)
+        if result is not None:
+            # Already committed, let the client repeat the commit.
+            return JsonResponse({"success": False, "offset": result['size']},
+                status=409 if request.method == 'POST' else 200)
+
+        if request.method != 'POST':
+            received = os.path.getsize(path) if os.path.exists(path) else 0
+            return JsonResponse({"offset": received})
+
+        try:
+            offset = int(data.get('offset'))
+        except (TypeError, ValueError):
+            return JsonResponse({"success": False, "error": "Invalid offset."}, status=400)
+        chunk = request.FILES.get('chunk')
+        if offset == 0:
+            self.sweep_upload_chunks()
+
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        with os.fdopen(fd, 'ab') as part:
+            lock_file(part)
+            # The size is only reliable while holding the lock.
+            received = os.fstat(part.fileno()).st_size
+            if chunk is None or offset != received:
+                return JsonResponse({"success": False, "offset": received}, status=409)
+            for piece in chunk.chunks():
+                part.write(piece)
+            part.flush()
+            received = os.fstat(part.fileno()).st_size
+        return JsonResponse({"success": True, "offset": received})
+
+    def upload_commit(self, request):
+        if request.method != 'POST' or not self.has_add_permission(request):
+            raise PermissionDenied
+
+        path = self.get_upload_chunk_path(request, request.POST.get('upload_id'))
+        if path is None:
+            return JsonResponse({"success": False, "error": "Invalid upload id."}, status=400)
+        result = self.read_upload_result(path)
+        if result is not None:
+            return JsonResponse({"success": True, "count": len(result['pks'])})
+        if not os.path.exists(path):
+            return JsonResponse({"success": False, "error": "Unknown upload id."}, status=400)
+
+        name = os.path.basename(request.POST.get('name') or '') or os.path.basename(path)
+        with open(path, 'rb') as part:
+            lock_file(part)
+            # A concurrent commit may have finished while waiting.
+            result = self.read_upload_result(path)
+            if result is not None:
+                return JsonResponse({"success": True, "count": len(result['pks'])})
+            received = os.fstat(part.fileno()).st_size
+            if str(received) != request.POST.get('size'):
+                return JsonResponse({"success": False, "offset": received}, status=409)
+
+            uploaded_file = ChunkedUploadFile(part, name=name)
+            pks = self.save_uploads(request, [uploaded_file])
+            with open(path[:-len('.part')] + '.done', 'w') as fh:
+                json.dump({"size": received, "pks": pks}, fh)
+        # Storages which could not move the file have copied it.
+        if os.path.exists(path):
+            os.remove(path)
+        self.sweep_upload_chunks()
+        return JsonResponse({"success": True, "count": len(pks)})
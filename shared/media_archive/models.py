@@ -1,17 +1,26 @@
+import hashlib
+import json
 import logging
 import posixpath
-import re
-
-from django.db import models
+from collections import Counter
+
+from django import VERSION as DJANGO_VERSION
+from django.apps import apps
+from django.db import connections, models, transaction
+from django.db.models.functions import Concat, Substr
+from django.db.models.signals import m2m_changed
+from django.utils.functional import cached_property
 from django.utils.html import strip_tags
 from django.utils.translation import ugettext_lazy as _
 
 from imagefield.fields import ImageField, PPOIField
-from imagekit.models import ImageSpecField
 from imagekit.processors import Adjust, Thumbnail, ResizeToFit, ResizeToFill
 from shared.utils.models.slugs import DowngradingSlugField, slugify
 
-from .conf import UPLOAD_TO, USE_TRANSLATABLE_FIELDS
+from .conf import DEDUPLICATE_FILES, SNIFF_FILE_TYPES, UPLOAD_TO, USE_TRANSLATABLE_FIELDS
+from .fields import ImageSpecField
+from .filetypes import CONTAINER_TYPES, read_head, sniff_file_type
+from .renditions import RenditionSet, delete_stale_rendition_sets, detect_image_format
 
 if USE_TRANSLATABLE_FIELDS:
     from content_plugins.fields import TranslatableCleansedRichTextField
@@ -41,9 +50,16 @@ class MediaCategory(models.Model):
         related_name='children', limit_choices_to={'parent__isnull': True},
         verbose_name=_("Übergeordnet"))
     slug = models.SlugField(_('slug'), max_length=150)
+    # Materialized path of primary keys from the root down to this
+    # category, e.g. "3/17/". Maintained in save(), rebuild with the
+    # `rebuild_media_category_paths` management command.
+    tree_path = models.CharField(_("tree path"), max_length=255,
+        blank=True, default='', editable=False, db_index=True)
 
     objects = MediaCategoryManager()
 
+    TREE_PATH_SEPARATOR = '/'
+
     class Meta:
         verbose_name = _("Working Folder")
         verbose_name_plural = _("Working Folders")
@@ -57,21 +73,176 @@ class MediaCategory(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+        old_tree_path = self.tree_path
         super().save(*args, **kwargs)
+
+        tree_path = self.build_tree_path()
+        if tree_path != old_tree_path:
+            MediaCategory.objects.filter(pk=self.pk).update(tree_path=tree_path)
+            self.tree_path = tree_path
+            if old_tree_path:
+                # Category was moved, rewrite the paths of all descendants
+                # in a single statement.
+                MediaCategory.objects.filter(
+                    tree_path__startswith=old_tree_path
+                ).exclude(pk=self.pk).update(tree_path=Concat(
+                    models.Value(tree_path),
+                    Substr('tree_path', len(old_tree_path) + 1),
+                    output_field=models.CharField()))
     save.alters_data = True
 
-    def path_list(self):
+    def build_tree_path(self):
+        prefix = ''
+        if self.parent_id:
+            prefix = self.parent.tree_path or self.parent.build_tree_path()
+        return '%s%s%s' % (prefix, self.pk, self.TREE_PATH_SEPARATOR)
+
+    def path_ids(self):
+        """
+        Primary keys from the root category down to this one, without
+        hitting the database.
+        """
+        if not self.tree_path:
+            return [c.pk for c in self._walk_path_list()]
+        return [int(pk) for pk in self.tree_path.split(self.TREE_PATH_SEPARATOR) if pk]
+
+    def ancestors(self):
+        return MediaCategory.objects.filter(pk__in=self.path_ids()[:-1])
+
+    def descendants(self, include_self=False):
+        if not self.tree_path:
+            self.tree_path = self.build_tree_path()
+        qs = MediaCategory.objects.filter(tree_path__startswith=self.tree_path)
+        if not include_self:
+            qs = qs.exclude(pk=self.pk)
+        return qs
+
+    def _walk_path_list(self):
         if self.parent is None:
             return [self]
-        p = self.parent.path_list()
+        p = self.parent._walk_path_list()
         p.append(self)
         return p
 
+    def path_list(self):
+        ids = self.path_ids()
+        if len(ids) == 1:
+            return [self]
+        if len(ids) == 2 and self.parent_id:
+            # The parent is usually already loaded by the manager.
+            return [self.parent, self]
+        categories = MediaCategory.objects.in_bulk(ids[:-1])
+        return [categories[pk] for pk in ids[:-1] if pk in categories] + [self]
+
     def path(self):
         return ' - '.join((f.name for f in self.path_list()))
 
 
-class Gallery(models.Model):
+def public_index(fields, name):
+    """
+    Index over ``fields`` restricted to public rows where the database
+    supports partial indexes. Other databases silently skip it, see
+    create_public_index_fallbacks.
+    """
+    if DJANGO_VERSION < (2, 2):
+        return models.Index(fields=['is_public'] + list(fields), name=name)
+    return models.Index(fields=list(fields), name=name, condition=models.Q(is_public=True))
+
+
+def create_public_index_fallbacks(app_config, using='default', **kwargs):
+    """
+    post_migrate handler creating plain ``is_public`` + fields indexes
+    instead of the partial indexes of public_index() on databases without
+    partial indexes (MySQL). Declaring both would make the migrations of
+    the project depend on the database backend.
+    """
+    connection = connections[using]
+    if DJANGO_VERSION < (2, 2) or connection.features.supports_partial_indexes:
+        return
+    for model in app_config.get_models():
+        partial = [
+            index for index in model._meta.indexes
+            if index.condition == models.Q(is_public=True)]
+        if not partial:
+            continue
+        with connection.cursor() as cursor:
+            existing = connection.introspection.get_constraints(cursor, model._meta.db_table)
+        for index in partial:
+            name = '%s_fallback' % index.name
+            if name not in existing:
+                with connection.schema_editor() as editor:
+                    editor.add_index(model, models.Index(
+                        fields=['is_public'] + list(index.fields), name=name))
+
+
+class SearchDocumentMixin(models.Model):
+    """
+    Keeps a denormalized plain text document of ``search_document_fields``
+    in all languages, used by the admin search (see .search).
+    """
+
+    search_text = models.TextField(_("search text"), blank=True, default='', editable=False)
+
+    search_document_fields = []
+
+    class Meta:
+        abstract = True
+
+    def build_search_document(self):
+        values = []
+        for field_name in self.search_document_fields:
+            for name in i18n_fields(field_name):
+                value = getattr(self, name, None)
+                if value:
+                    values.append(strip_tags(str(value)))
+        return ' '.join(values)
+
+    def save(self, *args, **kwargs):
+        self.search_text = self.build_search_document()
+        super().save(*args, **kwargs)
+    save.alters_data = True
+
+
+class DerivedFieldsQuerySetMixin:
+    def update_derived_fields(self, pk, **values):
+        """
+        Store values derived from the file or other fields of the row
+        ``pk``, such as hashes, sizes, search documents and manifests.
+        Unlike save() this neither touches ``modified`` nor overwrites
+        fields changed concurrently, and sends no signals.
+        """
+        return self.filter(pk=pk).update(**values)
+
+
+class GalleryQuerySet(DerivedFieldsQuerySetMixin, models.QuerySet):
+    def public(self):
+        return self.filter(is_public=True)
+
+    def bump_version(self):
+        return self.update(version=models.F('version') + 1)
+
+    def with_image_stats(self):
+        """
+        Annotate ``image_count`` and ``public_image_count``.
+        """
+        return self.annotate(
+            image_count=models.Count('images'),
+            public_image_count=models.Sum(models.Case(
+                models.When(images__is_public=True, then=1),
+                default=0, output_field=models.IntegerField())),
+        )
+
+    def prefetch_public_images(self):
+        """
+        Prefetch the ordered public images used by Gallery.public_images().
+        """
+        return self.prefetch_related(models.Prefetch(
+            'images',
+            queryset=Image.objects.filter(is_public=True),
+            to_attr='prefetched_public_images'))
+
+
+class Gallery(SearchDocumentMixin, models.Model):
     internal_name = models.CharField(_("Internal Name"), max_length=500,
         help_text=_("Internal use only, not publicly visible."))
     name = TranslatableCharField(_("Name"), max_length=200, null=True, blank=True,
@@ -88,30 +259,65 @@ class Gallery(models.Model):
     images = models.ManyToManyField('Image', blank=True,
         verbose_name=_("Images"),
         through='ImageGalleryRel')
+    # Incremented on every change of the gallery or its images, used for
+    # ETags of the JSON API.
+    version = models.PositiveIntegerField(_("version"), default=0, editable=False)
+
+    objects = GalleryQuerySet.as_manager()
+
+    search_document_fields = ['internal_name', 'name', 'slug', 'caption', 'credits']
 
     class Meta:
         verbose_name = _("Image Gallery")
         verbose_name_plural = _("Image Galleries")
         ordering = i18n_fields('name')
+        indexes = [
+            public_index(i18n_fields('name'), name='media_gallery_public_name'),
+        ]
 
     def __str__(self):
         return self.internal_name or self.name or self.slug
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            # Incremented in the database, concurrent bump_version() calls
+            # are not overwritten.
+            self.version = models.F('version') + 1
+        super().save(*args, **kwargs)
+        if not isinstance(self.version, int):
+            self.refresh_from_db(fields=['version'])
+    save.alters_data = True
+
     def public_images(self):
-        return self.images.filter(is_public=True)
+        if hasattr(self, 'prefetched_public_images'):
+            return self.prefetched_public_images
+        # Filter and order over the same relation path so both use one
+        # join and the (gallery, position) index.
+        return Image.objects.filter(
+            imagegalleryrel__gallery=self, is_public=True,
+        ).order_by('imagegalleryrel__position')
 
 
 def filename_to_slug(instance, field):
-    n, e = posixpath.splitext(instance.file.name)
+    # The base name, the file may be stored already (upload_to directory).
+    n, e = posixpath.splitext(posixpath.basename(instance.file.name))
     return slugify(n)
 
 
 class FileTypeMixin(models.Model):
+    """
+    File types are registered as ``(key, name, test)`` tuples, where
+    ``test`` is either a sequence of file name extensions or a predicate
+    receiving the file name. Earlier registrations take priority.
+    """
+
     type = models.CharField(_('file type'),
         max_length=12, editable=False, choices=())
 
     filetypes = []
     filetypes_dict = {}
+    filetypes_by_extension = {}
+    filetypes_predicates = []
 
     class Meta:
         abstract = True
@@ -123,14 +329,51 @@ class FileTypeMixin(models.Model):
         cls.filetypes_dict = dict(choices)
         cls._meta.get_field('type').choices = choices[:]
 
-    def determine_file_type(self, name):
-        for type_key, type_name, type_test in self.filetypes:
+        # Precompute an extension index, only custom predicates are tested
+        # one after another.
+        cls.filetypes_by_extension = {}
+        cls.filetypes_predicates = []
+        for priority, (type_key, type_name, type_test) in enumerate(cls.filetypes):
+            if callable(type_test):
+                cls.filetypes_predicates.append((priority, type_key, type_test))
+            else:
+                for extension in type_test:
+                    cls.filetypes_by_extension.setdefault(
+                        extension.lower(), (priority, type_key))
+
+    def determine_file_type(self, name, head=None):
+        """
+        File type of the file name ``name``; if the leading bytes ``head``
+        of the file are given, a recognized content type wins over a
+        misleading extension.
+        """
+        extension = posixpath.splitext(name)[1].lstrip('.').lower()
+        priority, type_key = self.filetypes_by_extension.get(
+            extension, (len(self.filetypes), None))
+        for predicate_priority, predicate_key, type_test in self.filetypes_predicates:
+            if predicate_priority > priority:
+                break
             if type_test(name):
-                return type_key
-        return self.filetypes[-1][0]
+                type_key = predicate_key
+                break
+        if type_key is None:
+            type_key = self.filetypes[-1][0]
+
+        if head:
+            sniffed = sniff_file_type(head)
+            if (sniffed in self.filetypes_dict and
+                    type_key not in CONTAINER_TYPES.get(sniffed, ())):
+                type_key = sniffed
+        return type_key
 
     def save(self, *args, **kwargs):
-        self.type = self.determine_file_type(self.file.name)
+        head = None
+        if SNIFF_FILE_TYPES and self.file and not self.file._committed:
+            try:
+                head = read_head(self.file)
+            except (OSError, IOError, ValueError) as e:
+                logger.error("Unable to read file head for %s: %s" % (self, e))
+        self.type = self.determine_file_type(self.file.name, head)
         super().save(*args, **kwargs)
     save.alters_data = True
 
@@ -141,6 +384,9 @@ class DeleteOldFileMixin:
         if self.file:
             self._original_file_name = self.file.name
 
+    def file_changed(self):
+        return self.file.name != getattr(self, '_original_file_name', None)
+
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
 
@@ -149,14 +395,34 @@ class DeleteOldFileMixin:
         if getattr(self, '_original_file_name', None):
             if self.file.name != self._original_file_name:
                 self.delete_mediafile(self._original_file_name)
+        self._original_file_name = self.file.name
 
     def delete_mediafile(self, name=None):
+        """
+        Queue the file for deletion; the entry commits with the current
+        transaction and is processed by `manage.py process_file_deletions`.
+        """
         if name is None:
             name = self.file.name
-        try:
-            self.file.storage.delete(name)
-        except Exception as e:
-            logger.warn("Cannot delete media file %s: %s" % (name, e))
+        PendingFileDeletion.objects.create(name=name, model_label=self._meta.label)
+
+
+class PendingFileDeletion(models.Model):
+    name = models.CharField(_("file name"), max_length=500)
+    model_label = models.CharField(_("model"), max_length=100)
+    created = models.DateTimeField(_("created"), auto_now_add=True)
+    attempts = models.PositiveIntegerField(_("attempts"), default=0)
+    last_error = models.TextField(_("last error"), blank=True)
+    # Set while a process_file_deletions run handles the entry.
+    claimed_until = models.DateTimeField(_("claimed until"), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("pending file deletion")
+        verbose_name_plural = _("pending file deletions")
+        ordering = ['pk']
+
+    def __str__(self):
+        return self.name
 
 
 class MediaRole(models.Model):
@@ -173,12 +439,136 @@ class MediaRole(models.Model):
         return self.name
 
 
-class MediaBaseManager(models.Manager):
-    def public_objects(self):
-        return self.get_queryset().filter(is_public=True)
+def file_digest(f, algorithm='sha256'):
+    """
+    Return ``(hexdigest, size)`` of a file, read in a single streamed pass.
+    """
+    digest = hashlib.new(algorithm)
+    size = 0
+    for chunk in f.chunks():
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+class MediaBaseQuerySet(DerivedFieldsQuerySetMixin, models.QuerySet):
+    """
+    Ordered public lookups matching the indexes declared on the concrete
+    media models.
+    """
+
+    def public(self):
+        return self.filter(is_public=True)
 
+    def public_by_name(self):
+        return self.public().order_by(*i18n_fields('name'), 'pk')
 
-class MediaBase(DeleteOldFileMixin, models.Model):
+    def public_for_role(self, role):
+        return self.filter(role=role, is_public=True)
+
+
+class MediaBaseManager(models.Manager.from_queryset(MediaBaseQuerySet)):
+    def public_objects(self):
+        return self.get_queryset().public()
+
+    def allocate_slugs(self, bases):
+        """
+        Unique slugs for a batch of base slugs, numbering repeated and
+        already used bases as ``<base>-<n>`` after their highest existing
+        suffix. Needs one query for all bases, plus one for those in use.
+        """
+        max_length = self.model._meta.get_field('slug').max_length or 50
+        bases = [(base or 'file')[:max_length] for base in bases]
+        unique_bases = list(dict.fromkeys(bases))
+        # Reserve room for the suffix when querying longer variants.
+        prefix_length = max(1, max_length - 8)
+
+        used = set()
+        for i in range(0, len(unique_bases), 500):
+            used.update(self.filter(
+                slug__in=unique_bases[i:i + 500]).values_list('slug', flat=True))
+        taken = set(used)
+        # Bases in use or repeated in the batch get suffixes, look up
+        # which of those exist already.
+        numbered = used | {base for base, n in Counter(bases).items() if n > 1}
+        if numbered:
+            query = models.Q()
+            for base in numbered:
+                query |= models.Q(slug__startswith=base[:prefix_length])
+            taken.update(self.filter(query).values_list('slug', flat=True))
+
+        counters = {}
+        slugs = []
+        for base in bases:
+            if base not in taken and base not in counters:
+                counters[base] = 1
+                taken.add(base)
+                slugs.append(base)
+                continue
+            if base not in counters:
+                # Continue after the highest numeric suffix in use.
+                prefix = base + '-'
+                counters[base] = max([1] + [
+                    int(slug[len(prefix):]) for slug in taken
+                    if slug.startswith(prefix) and slug[len(prefix):].isdigit()])
+            while True:
+                counters[base] += 1
+                suffix = '-%d' % counters[base]
+                slug = base[:max_length - len(suffix)] + suffix
+                if slug not in taken:
+                    break
+            taken.add(slug)
+            slugs.append(slug)
+        return slugs
+
+    def assign_slugs(self, objs):
+        """
+        Fill the empty slugs of unsaved ``objs`` using ``allocate_slugs()``
+        instead of letting each save probe for a free slug.
+        """
+        field = self.model._meta.get_field('slug')
+        objs = [obj for obj in objs if not obj.slug]
+        slugs = self.allocate_slugs([filename_to_slug(obj, field) for obj in objs])
+        for obj, slug in zip(objs, slugs):
+            obj.slug = slug
+
+    def add_categories(self, pks, categories, batch_size=500):
+        """
+        Assign ``categories`` to all media with the given primary keys
+        using one bulk insert per category; returns the number of
+        relations actually added.
+        """
+        field = self.model._meta.get_field('categories')
+        through = field.remote_field.through
+        source_name = field.m2m_field_name()
+        target_name = field.m2m_reverse_field_name()
+        pks = list(dict.fromkeys(pks))
+
+        count = 0
+        with transaction.atomic(using=self.db):
+            for category in categories:
+                existing = set(through.objects.filter(**{
+                    target_name: category}).values_list(source_name, flat=True))
+                new_pks = [pk for pk in pks if pk not in existing]
+                if not new_pks:
+                    continue
+
+                # Send the same signals as category.<media>_set.add() would.
+                signal_kwargs = {
+                    'sender': through, 'instance': category, 'reverse': True,
+                    'model': self.model, 'pk_set': set(new_pks), 'using': self.db,
+                }
+                m2m_changed.send(action='pre_add', **signal_kwargs)
+                through.objects.bulk_create([
+                    through(**{'%s_id' % source_name: pk, target_name: category})
+                    for pk in new_pks
+                ], batch_size=batch_size)
+                m2m_changed.send(action='post_add', **signal_kwargs)
+                count += len(new_pks)
+        return count
+
+
+class MediaBase(DeleteOldFileMixin, SearchDocumentMixin, models.Model):
     created = models.DateTimeField(_("Hochgeladen"), auto_now_add=True)
     modified = models.DateTimeField(_("Geändert"), auto_now=True)
     is_public = models.BooleanField(_("Veröffentlicht"), default=True,
@@ -187,6 +577,9 @@ class MediaBase(DeleteOldFileMixin, models.Model):
     # file = models.FileField(_("Datei"))
     file_size = models.IntegerField(_("file size"),
         blank=True, null=True, editable=False)
+    content_hash = models.CharField(_("content hash"), max_length=64,
+        blank=True, default='', editable=False, db_index=True,
+        help_text=_("SHA-256 digest of the file contents."))
     slug = DowngradingSlugField(blank=True,
         populate_from=filename_to_slug, unique_slug=True)
 
@@ -204,21 +597,97 @@ class MediaBase(DeleteOldFileMixin, models.Model):
 
     objects = MediaBaseManager()
 
+    search_document_fields = ['name', 'slug', 'caption', 'credits', 'copyright']
+
     class Meta:
         abstract = True
 
     def __str__(self):
         return self.name or strip_tags(self.caption) or posixpath.basename(self.file.name)
 
+    def build_search_document(self):
+        # The slug is derived from the file name, which is set already.
+        document = super().build_search_document()
+        if self.file:
+            document = '%s %s' % (document, posixpath.basename(self.file.name))
+        return document.strip()
+
     def save(self, *args, **kwargs):
         if self.file:
             try:
-                self.file_size = self.file.size
+                if not self.file._committed:
+                    # New upload, hash and measure it in one pass.
+                    self.content_hash, self.file_size = file_digest(self.file)
+                    if DEDUPLICATE_FILES:
+                        self.link_duplicate_file()
+                if not self.file._committed:
+                    # Store the file now (instead of in pre_save), so the
+                    # search document contains the final storage name.
+                    self.file.save(self.file.name, self.file.file, save=False)
+                elif self.file_size is None or self.file_changed():
+                    # Storage-derived metadata is only refreshed if the
+                    # file changed, a stat can be a remote request.
+                    self.file_size = self.file.size
             except (OSError, IOError, ValueError) as e:
                 logger.error("Unable to read file size for %s: %s" % (self, e))
         super().save(*args, **kwargs)
     save.alters_data = True
 
+    def find_duplicate(self):
+        if not self.content_hash:
+            return None
+        return type(self)._default_manager.filter(
+            content_hash=self.content_hash,
+        ).exclude(pk=self.pk).exclude(file='').order_by('pk').first()
+
+    def link_duplicate_file(self):
+        """
+        Point the file field to the stored file of an existing record with
+        identical contents instead of writing a new copy.
+        """
+        duplicate = self.find_duplicate()
+        if duplicate is None:
+            return False
+        self.file.name = duplicate.file.name
+        self.file._committed = True
+        return True
+
+
+def media_models():
+    """
+    All concrete models derived from MediaBase.
+    """
+    return [m for m in apps.get_models() if issubclass(m, MediaBase)]
+
+
+class RenditionEntry:
+    def __init__(self, url, width, height, size=None):
+        self.url = url
+        self.width = width
+        self.height = height
+        self.size = size
+
+
+class RenditionMap:
+    """
+    Spec name -> rendition mapping, served from the stored manifest and
+    falling back to imagekit's cache files for missing entries.
+
+        {{ image.renditions.gallery_image.url }}
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self.manifest = image.get_rendition_manifest()
+
+    def __getitem__(self, name):
+        if name in self.manifest:
+            return RenditionEntry(**self.manifest[name])
+        return getattr(self.image, name)
+
+    def __contains__(self, name):
+        return name in self.manifest
+
 
 class Image(MediaBase):
     image_width = models.PositiveIntegerField(
@@ -228,6 +697,13 @@ class Image(MediaBase):
         _("image height"), blank=True, null=True, editable=False
     )
     image_ppoi = PPOIField(_("primary point of interest"))
+    # JSON map of spec name -> url, width, height and size of generated
+    # renditions, see .renditions.generate_renditions
+    rendition_manifest = models.TextField(_("rendition manifest"),
+        blank=True, default='', editable=False)
+    image_format = models.CharField(_("image format"), max_length=10,
+        blank=True, default='', editable=False)
+    is_animated = models.BooleanField(_("animated"), default=False, editable=False)
     # file = models.ImageField(_("Datei"))
     file = ImageField(
         _("image"),
@@ -275,39 +751,232 @@ class Image(MediaBase):
         format='JPEG', options={'quality': 90})
     highres_image = lightbox_image
 
+    # Responsive renditions, generated together with the specs above and
+    # output by the {% picture %} and {% srcset %} tags from the manifest.
+    rendition_sets = {
+        'responsive': RenditionSet(widths=(400, 800, 1200, 1600, 2400)),
+        'square': RenditionSet(widths=(200, 400, 800), aspect_ratio=1),
+    }
+
+    # How specs treat animated sources: 'passthrough' serves the original
+    # file, 'resize' resizes all frames keeping the format, 'webp' converts
+    # to an animated WebP. Animated renditions are generated with the other
+    # specs, until then the spec renders the first frame.
+    animated_spec_policy = {
+        'lightbox_image': 'passthrough',
+    }
+    default_animated_spec_policy = 'resize'
+
     type = 'image'
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._original_ppoi = self.__dict__.get('image_ppoi')
+
     class Meta:
         verbose_name = _("Bild")
         verbose_name_plural = _("Bilder")
         ordering = ['imagegalleryrel__position']
+        indexes = [
+            models.Index(fields=['modified', 'id'], name='media_image_modified_id'),
+            models.Index(fields=['role', 'is_public'], name='media_image_role_public'),
+            public_index(i18n_fields('name') + ['id'], name='media_image_public_name'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.file and (not self.file._committed or self.file_changed()):
+            self.update_image_format()
+        # Renditions depend on the file and the PPOI.
+        ppoi_changed = (
+            self._original_ppoi is not None and self.image_ppoi != self._original_ppoi)
+        file_changed = self.file_changed()
+        if file_changed or ppoi_changed:
+            self.rendition_manifest = ''
+            self.__dict__.pop('renditions', None)
+        super().save(*args, **kwargs)
+        if ppoi_changed and not file_changed:
+            # The sets of the old PPOI are not regenerated under their
+            # names. Files of a replaced source go with its deletion.
+            transaction.on_commit(lambda: delete_stale_rendition_sets(self))
+        self._original_ppoi = self.image_ppoi
+    save.alters_data = True
+
+    #
+    # Rendition manifest
+
+    def get_rendition_manifest(self):
+        try:
+            return json.loads(self.rendition_manifest) if self.rendition_manifest else {}
+        except ValueError:
+            return {}
+
+    def update_rendition_manifest(self, entries):
+        manifest = self.get_rendition_manifest()
+        manifest.update(entries)
+        self.rendition_manifest = json.dumps(manifest, sort_keys=True)
+        self.__dict__.pop('renditions', None)
+        type(self)._default_manager.update_derived_fields(
+            self.pk, rendition_manifest=self.rendition_manifest)
+        Gallery.objects.filter(images=self).bump_version()
+
+    @cached_property
+    def renditions(self):
+        return RenditionMap(self)
 
     #
-    # Accessors to GIF images
-    # FIXME ImageKit should leave alone GIF images in the first place
-    # TODO Need more robust method to get image type
+    # Animated images
+
+    def update_image_format(self):
+        try:
+            self.image_format, self.is_animated = detect_image_format(self.file)
+        except (OSError, IOError, ValueError) as e:
+            logger.error("Unable to read image format of %s: %s" % (self, e))
+
+    def get_animated_spec_policy(self, spec_name):
+        return self.animated_spec_policy.get(spec_name, self.default_animated_spec_policy)
+
+    def animated_rendition(self, spec_name):
+        """
+        Rendition of ``spec_name`` for animated sources: the original file
+        for passthrough specs, else the generated animation or ``None``
+        (the spec's regular first frame rendition) until there is one.
+        """
+        if self.get_animated_spec_policy(spec_name) == 'passthrough':
+            return self.file
+        manifest = self.get_rendition_manifest()
+        if spec_name in manifest:
+            return RenditionEntry(**manifest[spec_name])
+        return None
 
     def gif_gallery_image_thumbnail(self, image_spec_name='gallery_image_thumbnail'):
-        # Return gif image URLs without converting.
-        name, ext = posixpath.splitext(self.file.name)
-        if ext == '.gif':
+        # Return animated images without converting.
+        if self.is_animated:
             return self.file
-        else:
-            return getattr(self, image_spec_name)
+        return getattr(self, image_spec_name)
 
     def gif_lightbox_image(self):
         return self.gif_gallery_image_thumbnail(image_spec_name='lightbox_image')
 
 
+def _increasing_subsequence(values):
+    """
+    Indexes of a longest strictly increasing subsequence of ``values``.
+    """
+    tails, previous = [], [None] * len(values)
+    for i, value in enumerate(values):
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if values[tails[mid]] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        previous[i] = tails[lo - 1] if lo else None
+        if lo == len(tails):
+            tails.append(i)
+        else:
+            tails[lo] = i
+    result = []
+    i = tails[-1] if tails else None
+    while i is not None:
+        result.append(i)
+        i = previous[i]
+    return result[::-1]
+
+
+class ImageGalleryRelManager(models.Manager):
+    def next_position(self, gallery):
+        last = self.filter(gallery=gallery).aggregate(
+            models.Max('position'))['position__max']
+        return 0 if last is None else last + self.model.POSITION_GAP
+
+    def reorder(self, gallery, rel_ids, batch_size=500):
+        """
+        Order the images of ``gallery`` like the relation ids ``rel_ids``,
+        which must contain all relations of the gallery. Rows already in
+        the right relative order keep their position, the others are
+        moved into the gaps; everything is only renumbered if a gap is
+        exhausted. Returns the number of updated rows.
+        """
+        rel_ids = [int(pk) for pk in rel_ids]
+        gap = self.model.POSITION_GAP
+        with transaction.atomic(using=self.db):
+            current = dict(self.select_for_update().filter(
+                gallery=gallery).values_list('pk', 'position'))
+            if len(rel_ids) != len(current) or set(rel_ids) != set(current):
+                raise ValueError("rel_ids must list every image of the gallery once.")
+
+            positions = [current[pk] for pk in rel_ids]
+            keep = set(_increasing_subsequence(positions))
+            new_positions = self._fill_gaps(positions, keep)
+            if new_positions is None:
+                new_positions = [i * gap for i in range(len(rel_ids))]
+            changed = [
+                (pk, position) for pk, position in zip(rel_ids, new_positions)
+                if current[pk] != position]
+
+            for i in range(0, len(changed), batch_size):
+                batch = changed[i:i + batch_size]
+                self.filter(pk__in=[pk for pk, _position in batch]).update(
+                    position=models.Case(
+                        *[models.When(pk=pk, then=models.Value(position))
+                          for pk, position in batch],
+                        output_field=models.PositiveIntegerField()))
+            if changed:
+                Gallery.objects.filter(pk=getattr(gallery, 'pk', gallery)).bump_version()
+        return len(changed)
+
+    def _fill_gaps(self, positions, keep):
+        gap = self.model.POSITION_GAP
+        result = list(positions)
+        i = 0
+        while i < len(result):
+            if i in keep:
+                i += 1
+                continue
+            # Spread the run of moved rows between its kept neighbours.
+            j = i
+            while j < len(result) and j not in keep:
+                j += 1
+            low = result[i - 1] if i else None
+            high = result[j] if j < len(result) else None
+            count = j - i
+            if low is None and high is None:
+                return None
+            if high is None:
+                values = [low + gap * k for k in range(1, count + 1)]
+            elif low is None:
+                if high < count:
+                    return None
+                step = min(gap, high // (count + 1) or 1)
+                values = [high - step * k for k in range(count, 0, -1)]
+            else:
+                step = (high - low) // (count + 1)
+                if step < 1:
+                    return None
+                values = [low + step * k for k in range(1, count + 1)]
+            result[i:j] = values
+            i = j
+        return result
+
+
 class ImageGalleryRel(models.Model):
+    # Positions are spaced out, so moving one image only updates its row.
+    POSITION_GAP = 1024
+
     image = models.ForeignKey(Image, on_delete=models.CASCADE)
     gallery = models.ForeignKey(Gallery, models.CASCADE)
     position = models.PositiveIntegerField(default=0)
 
+    objects = ImageGalleryRelManager()
+
     class Meta:
         verbose_name = _("Bild")
         verbose_name_plural = _("Bilder")
         ordering = ['position']
+        indexes = [
+            models.Index(fields=['gallery', 'position'], name='media_gallery_position'),
+        ]
 
 
 class Download(FileTypeMixin, MediaBase):
@@ -318,30 +987,27 @@ class Download(FileTypeMixin, MediaBase):
         verbose_name = _("Download")
         verbose_name_plural = _("Downloads")
         ordering = i18n_fields('name')
+        indexes = [
+            models.Index(fields=['modified', 'id'], name='media_download_modified_id'),
+            models.Index(fields=['role', 'is_public'], name='media_download_role_public'),
+            public_index(i18n_fields('name') + ['id'], name='media_download_public_name'),
+        ]
 
     def get_display_name(self):
         return self.name or posixpath.basename(self.file.name)
 
 
 Download.register_filetypes(
-    # Should we be using imghdr.what instead of extension guessing?
-    ('image', _('Image'), lambda f: re.compile(
-        r'\.(bmp|jpe?g|jp2|jxr|gif|png|tiff?)$', re.IGNORECASE).search(f)),
-    ('video', _('Video'), lambda f: re.compile(
-        r'\.(mov|m[14]v|mp4|avi|mpe?g|qt|ogv|wmv|flv)$',
-        re.IGNORECASE).search(f)),
-    ('audio', _('Audio'), lambda f: re.compile(
-        r'\.(au|mp3|m4a|wma|oga|ram|wav)$', re.IGNORECASE).search(f)),
-    ('pdf', _('PDF document'), lambda f: f.lower().endswith('.pdf')),
-    ('swf', _('Flash'), lambda f: f.lower().endswith('.swf')),
-    ('txt', _('Text'), lambda f: f.lower().endswith('.txt')),
-    ('rtf', _('Rich Text'), lambda f: f.lower().endswith('.rtf')),
-    ('zip', _('Zip archive'), lambda f: f.lower().endswith('.zip')),
-    ('doc', _('Microsoft Word'), lambda f: re.compile(
-        r'\.docx?$', re.IGNORECASE).search(f)),
-    ('xls', _('Microsoft Excel'), lambda f: re.compile(
-        r'\.xlsx?$', re.IGNORECASE).search(f)),
-    ('ppt', _('Microsoft PowerPoint'), lambda f: re.compile(
-        r'\.pptx?$', re.IGNORECASE).search(f)),
+    ('image', _('Image'), ('bmp', 'jpg', 'jpeg', 'jp2', 'jxr', 'gif', 'png', 'tif', 'tiff')),
+    ('video', _('Video'), ('mov', 'm1v', 'm4v', 'mp4', 'avi', 'mpg', 'mpeg', 'qt', 'ogv', 'wmv', 'flv')),
+    ('audio', _('Audio'), ('au', 'mp3', 'm4a', 'wma', 'oga', 'ram', 'wav')),
+    ('pdf', _('PDF document'), ('pdf',)),
+    ('swf', _('Flash'), ('swf',)),
+    ('txt', _('Text'), ('txt',)),
+    ('rtf', _('Rich Text'), ('rtf',)),
+    ('zip', _('Zip archive'), ('zip',)),
+    ('doc', _('Microsoft Word'), ('doc', 'docx')),
+    ('xls', _('Microsoft Excel'), ('xls', 'xlsx')),
+    ('ppt', _('Microsoft PowerPoint'), ('ppt', 'pptx')),
     ('other', _('Binary'), lambda f: True),  # Must be last
 )
@@ -0,0 +1,176 @@
+"""
+Detection of files in the media storage which no record references.
+
+The storage is walked one directory at a time. The sorted listing of a
+directory is merged with the referenced names streamed from the database
+in the same order, on SQLite and PostgreSQL the references are never held
+in memory.
+"""
+import heapq
+import posixpath
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.db.models import Q
+
+try:
+    from django.db.models.functions import Collate
+except ImportError:  # Django < 3.2
+    Collate = None
+
+from .conf import RENDITION_SET_DIR, UPLOAD_TO
+from .deletions import rendition_files
+from .models import Image, media_models
+
+
+def upload_root():
+    """
+    Static directory part of MEDIARCHIVE_UPLOAD_TO, empty if it has none
+    (e.g. ``'%Y/%m/'``).
+    """
+    if '%' not in UPLOAD_TO:
+        return UPLOAD_TO.rstrip('/')
+    prefix = UPLOAD_TO.split('%')[0]
+    return prefix.rstrip('/') if prefix.endswith('/') else posixpath.dirname(prefix)
+
+
+def rendition_root():
+    return getattr(settings, 'IMAGEKIT_CACHEFILE_DIR', 'CACHE/images').rstrip('/')
+
+
+def cache_directories():
+    """
+    Directories of generated files, never treated as upload directories.
+    """
+    return {rendition_root(), RENDITION_SET_DIR.rstrip('/')}
+
+
+def iter_directories(storage, path, skip=()):
+    """
+    Yield ``(directory, sorted file names)`` for ``path`` and all its
+    subdirectories except ``skip``; works with any storage implementing
+    ``listdir``.
+    """
+    try:
+        dirs, files = storage.listdir(path)
+    except (OSError, IOError):
+        return
+    yield path, sorted(files)
+    for d in sorted(dirs):
+        subdirectory = posixpath.join(path, d)
+        if subdirectory not in skip:
+            yield from iter_directories(storage, subdirectory, skip)
+
+
+def merge_unreferenced(listed, referenced):
+    """
+    Names of the sorted iterable ``listed`` missing from the sorted
+    iterable ``referenced``. Raises ``ValueError`` if ``referenced`` is
+    not sorted, a wrong order would report referenced files as orphans.
+    """
+    referenced = iter(referenced)
+    current = next(referenced, None)
+    for name in listed:
+        while current is not None and current < name:
+            previous, current = current, next(referenced, None)
+            if current is not None and current < previous:
+                raise ValueError(
+                    "Referenced names are not sorted: %r after %r" % (current, previous))
+        if name != current:
+            yield name
+
+
+def code_point_ordering(queryset, field_name):
+    """
+    Ordering of ``field_name`` matching the way Python sorts strings, None
+    if the database cannot be relied upon for it. The default collation of
+    PostgreSQL databases usually ignores punctuation, MySQL's case.
+    """
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite':
+        return field_name
+    if vendor == 'postgresql' and Collate is not None:
+        return Collate(field_name, 'C')
+    return None
+
+
+def _files_in_directory(model, path):
+    # A prefix lookup can use an index, unlike a regex.
+    prefix = '%s/' % path
+    queryset = model._default_manager.filter(file__startswith=prefix)
+    ordering = code_point_ordering(queryset, 'file')
+    if ordering is None:
+        names = sorted(queryset.values_list('file', flat=True))
+    else:
+        names = queryset.order_by(ordering).values_list('file', flat=True).iterator()
+    return (name for name in names if '/' not in name[len(prefix):])
+
+
+def unreferenced_files(storage, root=None):
+    """
+    Yield names of files below ``root`` (by default the static directory
+    of MEDIARCHIVE_UPLOAD_TO) which no media record references. Refuses to
+    scan the whole storage, it usually contains files of other apps.
+    """
+    root = (upload_root() if root is None else root).strip('/')
+    if not root:
+        raise ImproperlyConfigured(
+            "MEDIARCHIVE_UPLOAD_TO (%r) has no static upload directory, "
+            "the directory to scan must be given explicitly." % UPLOAD_TO)
+    models = [
+        m for m in media_models()
+        if m._meta.get_field('file').storage is storage]
+    for path, files in iter_directories(storage, root, cache_directories()):
+        referenced = heapq.merge(*[_files_in_directory(model, path) for model in models])
+        listed = (posixpath.join(path, f) for f in files)
+        yield from merge_unreferenced(listed, referenced)
+
+
+def _rendition_sources(model, source_bases):
+    """
+    Map each of ``source_bases`` (source names without extension) to the
+    names of the model's files with this base and any extension.
+    """
+    query = Q()
+    for base in source_bases:
+        query |= Q(file__startswith='%s.' % base)
+    sources = {base: [] for base in source_bases}
+    for name in model._default_manager.filter(query).values_list('file', flat=True).iterator():
+        base, ext = posixpath.splitext(name)
+        if base in sources and ext:
+            sources[base].append(name)
+    return sources
+
+
+def unreferenced_renditions(batch_size=100):
+    """
+    Yield ``(storage, name)`` of cached image renditions whose source image
+    does not exist anymore or which belong to outdated specs. Assumes
+    imagekit's default ``source_name_as_path`` cache file namer. The
+    sources of ``batch_size`` cache directories are looked up at once.
+    """
+    root = rendition_root()
+    for model in media_models():
+        if not issubclass(model, Image):
+            continue
+        cachefiles = rendition_files(model, 'probe.jpg')
+        if not cachefiles:
+            continue
+        storage = cachefiles[0].storage
+        directories = (
+            (path, files) for path, files in iter_directories(storage, root) if files)
+        while True:
+            batch = list(islice(directories, batch_size))
+            if not batch:
+                break
+            sources = _rendition_sources(model, [path[len(root) + 1:] for path, files in batch])
+            for path, files in batch:
+                expected = sorted(
+                    cachefile.name
+                    for name in sources[path[len(root) + 1:]]
+                    for cachefile in rendition_files(model, name))
+                listed = (posixpath.join(path, f) for f in files)
+                for name in merge_unreferenced(listed, expected):
+                    yield storage, name
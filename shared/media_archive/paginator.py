@@ -0,0 +1,205 @@
+import binascii
+import json
+import logging
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.contrib.admin.views.main import PAGE_VAR, ChangeList
+from django.core.paginator import Page, Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+logger = logging.getLogger(__name__)
+
+CURSOR_VAR = 'cursor'
+
+
+def estimate_count(queryset):
+    """
+    Row count estimate of ``queryset`` from the query planner's table
+    statistics, or ``None`` if the database doesn't provide one.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.query.sql_with_params()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) %s' % sql, params)
+            plan = cursor.fetchone()[0]
+    except DatabaseError as e:
+        logger.warning("Unable to estimate row count: %s" % e)
+        return None
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def is_unfiltered(queryset):
+    return not queryset.query.where
+
+
+class KeysetPage(Page):
+    """
+    Page with cursors to the neighbouring pages, built from the keyset
+    values of its first and last row.
+    """
+
+    def _cursor(self, row, number, direction):
+        return encode_cursor(number, direction, [
+            getattr(row, field) for field in self.paginator.keyset_fields])
+
+    @cached_property
+    def next_cursor(self):
+        rows = list(self.object_list)
+        if not rows or not self.has_next():
+            return None
+        return self._cursor(rows[-1], self.number + 1, 'next')
+
+    @cached_property
+    def previous_cursor(self):
+        rows = list(self.object_list)
+        if not rows or not self.has_previous():
+            return None
+        return self._cursor(rows[0], self.number - 1, 'previous')
+
+
+def encode_cursor(number, direction, values):
+    # Full precision ISO format, DjangoJSONEncoder cuts microseconds.
+    values = [v.isoformat() if hasattr(v, 'isoformat') else v for v in values]
+    data = json.dumps([number, direction, values])
+    return urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    ``(page number, direction, keyset values)`` or ``None``.
+    """
+    try:
+        data = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        number, direction, values = json.loads(data.decode())
+        if direction in ('next', 'previous') and isinstance(values, list):
+            return int(number), direction, values
+    except (TypeError, ValueError, binascii.Error):
+        pass
+    return None
+
+
+class KeysetPaginator(Paginator):
+    """
+    Paginator for changelists ordered by ``keyset_fields`` (e.g. the
+    default ``-modified`` ordering, to which the ChangeList adds ``-pk``).
+
+    Pages reached through the previous/next links carry a cursor with the
+    keyset values of the neighbouring row and are fetched with a keyset
+    filter instead of an OFFSET; other pages fall back to OFFSET. Counts
+    of the unfiltered table above ``estimate_threshold`` are taken from
+    the planner statistics, filtered lists are always counted exactly.
+    """
+
+    keyset_fields = ('modified', 'pk')
+    estimate_threshold = 10000
+    keyset_navigation = True
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True,
+                 cursor=None):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.cursor = decode_cursor(cursor) if cursor else None
+        self.current_page = None
+
+    @cached_property
+    def count(self):
+        if is_unfiltered(self.object_list):
+            estimate = estimate_count(self.object_list)
+            if estimate is not None and estimate > self.estimate_threshold:
+                return estimate
+        return self.object_list.count()
+
+    def keyset_direction(self):
+        """
+        ``'-'`` or ``''`` if the object list is ordered by the keyset
+        fields, ``None`` otherwise.
+        """
+        query = getattr(self.object_list, 'query', None)
+        if query is None:
+            return None
+        pk_name = self.object_list.model._meta.pk.name
+        ordering = [
+            o.replace(pk_name, 'pk') if o.lstrip('-') == pk_name else o
+            for o in query.order_by if isinstance(o, str)]
+        for direction in ('-', ''):
+            if ordering == [direction + f for f in self.keyset_fields]:
+                return direction
+        return None
+
+    def seek(self, values, lookup, inclusive=False):
+        (first, first_value), (second, second_value) = zip(self.keyset_fields, values)
+        return (
+            Q(**{'%s__%s' % (first, lookup): first_value}) |
+            Q(**{first: first_value, '%s__%s%s' % (second, lookup, 'e' if inclusive else ''): second_value}))
+
+    def _get_page(self, *args, **kwargs):
+        self.current_page = KeysetPage(*args, **kwargs)
+        return self.current_page
+
+    def page(self, number):
+        number = self.validate_number(number)
+        direction = self.keyset_direction()
+        cursor = self.cursor
+        if (number == 1 or direction is None or cursor is None
+                or cursor[0] != number or len(cursor[2]) != len(self.keyset_fields)):
+            return super().page(number)
+
+        forward = 'lt' if direction == '-' else 'gt'
+        backward = 'gt' if direction == '-' else 'lt'
+        if cursor[1] == 'next':
+            # Rows after the last row of the previous page.
+            return self._get_page(
+                self.object_list.filter(self.seek(cursor[2], forward))[:self.per_page],
+                number, self)
+
+        # Rows before the first row of the next page; look up the first
+        # row of this page with a narrow query in the reverse order.
+        reverse = [('' if direction == '-' else '-') + f for f in self.keyset_fields]
+        before = list(self.object_list.filter(self.seek(cursor[2], backward)).order_by(
+            *reverse).values_list(*self.keyset_fields)[:self.per_page])
+        if not before:
+            return super().page(number)
+        return self._get_page(
+            self.object_list.filter(self.seek(before[-1], forward, inclusive=True))[:self.per_page],
+            number, self)
+
+
+class KeysetChangeList(ChangeList):
+    """
+    ChangeList passing the cursor of KeysetPaginator links through.
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # A cursor only belongs to the link it was built for.
+        new_params = dict(new_params or {})
+        new_params.setdefault(CURSOR_VAR, None)
+        return super().get_query_string(new_params, remove)
+
+    def _page_url(self, cursor, offset):
+        if cursor is None:
+            return None
+        return self.get_query_string({
+            PAGE_VAR: int(self.page_num) + offset, CURSOR_VAR: cursor})
+
+    def first_page_url(self):
+        return self.get_query_string({PAGE_VAR: None})
+
+    def next_page_url(self):
+        page = getattr(self.paginator, 'current_page', None)
+        return page and self._page_url(page.next_cursor, 1)
+
+    def previous_page_url(self):
+        page = getattr(self.paginator, 'current_page', None)
+        return page and self._page_url(page.previous_cursor, -1)
@@ -0,0 +1,579 @@
+import hashlib
+import logging
+import posixpath
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from io import BytesIO
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.db import connections
+
+from imagekit.cachefiles.backends import CacheFileState
+from imagekit.models import ImageSpecField
+from pilkit.processors import ResizeToFill, ResizeToFit, Thumbnail
+from pilkit.utils import img_to_fobj, open_image
+from PIL import Image as PILImage, ImageSequence
+
+from .conf import PREGENERATE_WORKERS, RENDITION_SET_DIR
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+Rendition = namedtuple('Rendition', 'file width height')
+
+
+def image_spec_names(model):
+    """
+    Names of all ImageSpecFields of ``model``, aliases like
+    ``highres_image = lightbox_image`` are only returned once.
+    """
+    names, seen = [], set()
+    for klass in model.__mro__:
+        for name in vars(klass):
+            field = getattr(model, name, None)
+            if isinstance(field, ImageSpecField) and id(field) not in seen:
+                seen.add(id(field))
+                names.append(name)
+    return names
+
+
+class RenditionSet:
+    """
+    Declarative ladder of widths, rendered in each of ``formats`` which the
+    installed Pillow can write. JPEG should come last as the fallback.
+    With ``aspect_ratio`` (width / height) images are cropped around their
+    primary point of interest first.
+    """
+
+    MIME_TYPES = {'AVIF': 'image/avif', 'WEBP': 'image/webp', 'JPEG': 'image/jpeg', 'PNG': 'image/png'}
+    EXTENSIONS = {'AVIF': 'avif', 'WEBP': 'webp', 'JPEG': 'jpg', 'PNG': 'png'}
+    DEFAULT_OPTIONS = {
+        'AVIF': {'quality': 60},
+        'WEBP': {'quality': 80},
+        'JPEG': {'quality': 85, 'progressive': True},
+    }
+
+    def __init__(self, widths, formats=('AVIF', 'WEBP', 'JPEG'), aspect_ratio=None, options=None):
+        self.widths = sorted(widths, reverse=True)
+        self.formats = formats
+        self.aspect_ratio = aspect_ratio
+        self.options = dict(self.DEFAULT_OPTIONS, **(options or {}))
+
+    def __repr__(self):
+        return 'RenditionSet(%r, %r, %r, %r)' % (
+            self.widths, self.formats, self.aspect_ratio, sorted(self.options.items()))
+
+    def supported_formats(self):
+        PILImage.init()
+        return [f for f in self.formats if f in PILImage.SAVE]
+
+
+def rendition_set_directory(name):
+    return posixpath.join(RENDITION_SET_DIR, posixpath.splitext(name)[0])
+
+
+RENDITION_SET_FILE_RE = re.compile(r'^(?P<set_name>.+)-(?P<key>[0-9a-f]{8})-\d+w\.\w+$')
+
+
+def rendition_set_key(ppoi, rendition_set):
+    return hashlib.md5(('%s:%r' % (ppoi, rendition_set)).encode()).hexdigest()[:8]
+
+
+def delete_stale_rendition_sets(image):
+    """
+    Delete the stored rendition set files of ``image`` which were generated
+    for another PPOI or an earlier definition of the set. Returns the
+    number of deleted files.
+    """
+    rendition_sets = getattr(image, 'rendition_sets', None)
+    if not rendition_sets or not image.file:
+        return 0
+    storage = image.file.storage
+    directory = rendition_set_directory(image.file.name)
+    ppoi = getattr(image, 'image_ppoi', None)
+    keys = {
+        set_name: rendition_set_key(ppoi, rendition_set)
+        for set_name, rendition_set in rendition_sets.items()}
+    try:
+        dirs, files = storage.listdir(directory)
+    except (OSError, IOError, NotImplementedError):
+        return 0
+    deleted = 0
+    for f in files:
+        match = RENDITION_SET_FILE_RE.match(f)
+        if match and match.group('set_name') in keys and match.group('key') != keys[
+                match.group('set_name')]:
+            try:
+                storage.delete(posixpath.join(directory, f))
+                deleted += 1
+            except Exception as e:
+                logger.warning("Cannot delete stale rendition %s: %s" % (f, e))
+    return deleted
+
+
+def crop_to_ppoi(img, aspect_ratio, ppoi):
+    width, height = img.size
+    try:
+        x, y = (float(v) for v in (ppoi or '0.5x0.5').split('x'))
+    except ValueError:
+        x, y = 0.5, 0.5
+    if width / height > aspect_ratio:
+        new_width = int(round(height * aspect_ratio))
+        left = min(max(int(x * width - new_width / 2), 0), width - new_width)
+        return img.crop((left, 0, left + new_width, height))
+    new_height = int(round(width / aspect_ratio))
+    top = min(max(int(y * height - new_height / 2), 0), height - new_height)
+    return img.crop((0, top, width, top + new_height))
+
+
+def rendition_set_required_size(size, rendition_set):
+    """
+    Minimum decoded source size for the largest width of ``rendition_set``.
+    """
+    width, height = size
+    crop_width = width
+    if rendition_set.aspect_ratio:
+        crop_width = min(width, height * rendition_set.aspect_ratio)
+    ratio = min(rendition_set.widths[0] / crop_width, 1)
+    return int(width * ratio), int(height * ratio)
+
+
+def generate_rendition_set(image, set_name, rendition_set, img=None):
+    """
+    Render and store ``rendition_set`` of ``image``, each width derived
+    from the next larger one. ``img`` is the already decoded source, by
+    default the file is decoded here.
+
+    Returns the manifest entry, a list of dicts with format, mime type,
+    url, width, height and size.
+    """
+    storage = image.file.storage
+    ppoi = getattr(image, 'image_ppoi', None)
+    key = rendition_set_key(ppoi, rendition_set)
+    directory = rendition_set_directory(image.file.name)
+    formats = rendition_set.supported_formats()
+
+    if img is None:
+        image.file.open('rb')
+        try:
+            img = decode_image(image.file, [
+                lambda size: rendition_set_required_size(size, rendition_set)])
+        finally:
+            image.file.close()
+    if rendition_set.aspect_ratio:
+        img = crop_to_ppoi(img, rendition_set.aspect_ratio, ppoi)
+
+    # Never upscale, but keep at least the largest possible width.
+    widths = [w for w in rendition_set.widths if w <= img.size[0]] or [img.size[0]]
+
+    entries = []
+    current = img
+    for width in widths:
+        height = max(1, int(round(current.size[1] * width / current.size[0])))
+        if current.size[0] != width:
+            current = current.resize((width, height), PILImage.LANCZOS)
+        for fmt in formats:
+            content = img_to_fobj(current, fmt, True, **rendition_set.options.get(fmt, {})).read()
+            name = posixpath.join(directory, '%s-%s-%dw.%s' % (
+                set_name, key, width, rendition_set.EXTENSIONS.get(fmt, fmt.lower())))
+            if storage.exists(name):
+                storage.delete(name)
+            name = storage.save(name, ContentFile(content))
+            entries.append({
+                'format': fmt, 'type': rendition_set.MIME_TYPES.get(fmt, ''),
+                'url': storage.url(name), 'width': width, 'height': height,
+                'size': len(content),
+            })
+    return entries
+
+
+def detect_image_format(f):
+    """
+    Return ``(format, is_animated)`` of an image file, reading only what
+    Pillow needs to tell.
+    """
+    f.seek(0)
+    img = PILImage.open(f)
+    try:
+        return img.format or '', bool(getattr(img, 'is_animated', False))
+    finally:
+        f.seek(0)
+
+
+ANIMATED_FORMATS = {'resize': None, 'webp': 'WEBP'}
+
+
+def _animated_frames(img, processor_lists):
+    """
+    Decode the frames of ``img`` once and pass each through every list of
+    ``processor_lists``. Only the current source frame is held decoded,
+    the processed frames are kept at their output size.
+
+    Returns the processed frames per processor list and the durations.
+    """
+    outputs = [[] for processors in processor_lists]
+    durations = []
+    for frame in ImageSequence.Iterator(img):
+        durations.append(frame.info.get('duration', 100))
+        frame = frame.convert('RGBA')
+        for processors, frames in zip(processor_lists, outputs):
+            processed = frame
+            for processor in processors:
+                processed = processor.process(processed)
+            frames.append(processed)
+    return outputs, durations
+
+
+def generate_animated_renditions(image, spec_names=None, force=False):
+    """
+    Render the specs of an animated image according to its
+    ``get_animated_spec_policy()``: every frame goes through the spec's
+    processors and the result is stored as an animation, recorded in the
+    rendition manifest. Passthrough specs need no files.
+    """
+    manifest = image.get_rendition_manifest()
+    todo = []
+    skipped = 0
+    for name in spec_names or image_spec_names(type(image)):
+        policy = image.get_animated_spec_policy(name)
+        if policy not in ANIMATED_FORMATS or (not force and name in manifest):
+            skipped += 1
+            continue
+        todo.append((name, policy))
+    if not todo:
+        return 0, skipped
+
+    storage = image.file.storage
+    directory = rendition_set_directory(image.file.name)
+    entries = {}
+    image.file.open('rb')
+    try:
+        img = PILImage.open(image.file)
+        source_format = img.format
+        loop = img.info.get('loop', 0)
+        outputs, durations = _animated_frames(img, [
+            list(getattr(type(image), name).get_spec(source=image.file).processors)
+            for name, policy in todo])
+
+        for (name, policy), frames in zip(todo, outputs):
+            first = frames[0]
+            fmt = ANIMATED_FORMATS[policy] or source_format
+            fobj = BytesIO()
+            first.save(
+                fobj, fmt, save_all=True, append_images=frames[1:],
+                duration=durations, loop=loop)
+            content = fobj.getvalue()
+            file_name = posixpath.join(directory, '%s-animated.%s' % (name, fmt.lower()))
+            if storage.exists(file_name):
+                storage.delete(file_name)
+            file_name = storage.save(file_name, ContentFile(content))
+            entries[name] = {
+                'url': storage.url(file_name), 'width': first.size[0],
+                'height': first.size[1], 'size': len(content),
+            }
+    finally:
+        image.file.close()
+    image.update_rendition_manifest(entries)
+    return len(entries), skipped
+
+
+def _required_size(size, processors):
+    """
+    Minimum source size (preserving the aspect ratio of ``size``) which
+    yields the same output for ``processors``, or ``None`` if unknown.
+    """
+    width, height = size
+    for processor in processors:
+        if type(processor) is ResizeToFit and processor.width and processor.height:
+            ratio = min(processor.width / width, processor.height / height)
+            break
+        if type(processor) in (ResizeToFill, Thumbnail) and processor.width and processor.height:
+            ratio = max(processor.width / width, processor.height / height)
+            break
+        if hasattr(processor, 'width') or hasattr(processor, 'height'):
+            return None
+    else:
+        return None
+    ratio = min(ratio, 1)
+    return int(width * ratio), int(height * ratio)
+
+
+def _is_plain_downscale(processors):
+    # Output keeps the aspect ratio and can serve as source of smaller specs.
+    return (
+        len(processors) == 1 and type(processors[0]) is ResizeToFit and
+        getattr(processors[0], 'mat_color', None) is None)
+
+
+def decode_image(source, required_sizes):
+    """
+    Open and load ``source``. ``required_sizes`` are callables returning
+    the minimum size a consumer needs from the original size, or ``None``
+    if it needs the full size; JPEGs are decoded at a reduced size if all
+    of them allow it.
+    """
+    img = open_image(source)
+    required = [required_size(img.size) for required_size in required_sizes]
+    if img.format == 'JPEG' and required and None not in required:
+        img.draft(img.mode, (max(r[0] for r in required), max(r[1] for r in required)))
+    img.load()
+    return img
+
+
+def spec_required_size(generator):
+    processors = list(generator.processors)
+    return lambda size: _required_size(size, processors)
+
+
+def render_specs(source, generators, img=None):
+    """
+    Render several image specs of one source file, decoding it only once.
+
+    ``generators`` maps names to imagekit ImageSpec instances. JPEG sources
+    are decoded at a reduced size if all specs allow it, and plain
+    downscales serve as intermediates of the smaller specs. ``img`` is the
+    already decoded source (see decode_image), if given.
+
+    Returns a dict mapping names to Rendition tuples of a file-like object
+    with the encoded output and its dimensions.
+    """
+    if img is None:
+        img = decode_image(source, [spec_required_size(g) for g in generators.values()])
+    # Draft decoding may have reduced the size, derive the requirements
+    # from the actual one.
+    original_size = img.size
+    source_format = img.format
+    specs = []
+    for name, generator in generators.items():
+        processors = list(generator.processors)
+        specs.append((name, generator, processors, _required_size(original_size, processors)))
+
+    # Larger specs first, so smaller ones can be derived from them.
+    specs.sort(key=lambda spec: spec[3] or original_size, reverse=True)
+    intermediates = [img]
+    results = {}
+    for name, generator, processors, required_size in specs:
+        base = img
+        if required_size:
+            for candidate in intermediates:
+                if candidate.size[0] >= required_size[0] and candidate.size[1] >= required_size[1]:
+                    if candidate.size[0] < base.size[0]:
+                        base = candidate
+
+        output = base
+        for processor in processors:
+            output = processor.process(output)
+        if _is_plain_downscale(processors):
+            intermediates.append(output)
+
+        options = getattr(generator, 'options', None) or {}
+        results[name] = Rendition(
+            img_to_fobj(
+                output, getattr(generator, 'format', None) or source_format,
+                getattr(generator, 'autoconvert', True), **options),
+            output.size[0], output.size[1])
+    return results
+
+
+def manifest_entry(cachefile, width=None, height=None, size=None):
+    if width is None or height is None:
+        width, height = cachefile.width, cachefile.height
+    if size is None:
+        size = cachefile.storage.size(cachefile.name)
+    return {'url': cachefile.url, 'width': width, 'height': height, 'size': size}
+
+
+def generate_renditions(image, spec_names=None, force=False):
+    """
+    Generate the cached files of all (or the given) image specs of
+    ``image``, skipping existing ones unless ``force`` is set. Models with
+    a rendition manifest (see Image.renditions) get it updated.
+
+    Returns a ``(generated, skipped)`` tuple.
+    """
+    skipped = 0
+    if not image.file:
+        return 0, skipped
+
+    animated = 0
+    spec_names = spec_names or image_spec_names(type(image))
+    if getattr(image, 'is_animated', False):
+        # Non-passthrough specs are animated, the others are served as
+        # the original. Rendition sets show the first frame.
+        animated, skipped = generate_animated_renditions(image, spec_names, force)
+        static_specs = []
+    else:
+        static_specs = spec_names
+
+    has_manifest = hasattr(image, 'update_rendition_manifest')
+    manifest = image.get_rendition_manifest() if has_manifest else {}
+    entries = {}
+
+    cachefiles = {}
+    for name in static_specs:
+        cachefile = getattr(image, name)
+        if not force and cachefile.cachefile_backend.exists(cachefile):
+            skipped += 1
+            if has_manifest and name not in manifest:
+                entries[name] = manifest_entry(cachefile)
+            continue
+        cachefiles[name] = cachefile
+
+    # Rendition sets are only kept track of in the manifest.
+    rendition_sets = {}
+    if has_manifest and set(spec_names) >= set(image_spec_names(type(image))):
+        for set_name, rendition_set in getattr(image, 'rendition_sets', {}).items():
+            if not force and 'set:%s' % set_name in manifest:
+                skipped += 1
+            else:
+                rendition_sets[set_name] = rendition_set
+
+    generated = animated + len(cachefiles) + len(rendition_sets)
+    outputs = {}
+    if cachefiles or rendition_sets:
+        # One decode for all specs and rendition sets.
+        image.file.open('rb')
+        try:
+            img = decode_image(image.file, [
+                spec_required_size(cachefile.generator) for cachefile in cachefiles.values()
+            ] + [
+                (lambda size, rs=rendition_set: rendition_set_required_size(size, rs))
+                for rendition_set in rendition_sets.values()
+            ])
+            outputs = render_specs(image.file, {
+                name: cachefile.generator for name, cachefile in cachefiles.items()}, img)
+        finally:
+            image.file.close()
+        for set_name, rendition_set in rendition_sets.items():
+            entries['set:%s' % set_name] = generate_rendition_set(
+                image, set_name, rendition_set, img)
+        if rendition_sets:
+            delete_stale_rendition_sets(image)
+
+    for name, cachefile in cachefiles.items():
+        storage = cachefile.storage
+        if storage.exists(cachefile.name):
+            storage.delete(cachefile.name)
+        content = outputs[name].file.read()
+        storage.save(cachefile.name, ContentFile(content))
+        set_state = getattr(cachefile.cachefile_backend, 'set_state', None)
+        if set_state is not None:
+            set_state(cachefile, CacheFileState.EXISTS)
+        if has_manifest:
+            entries[name] = manifest_entry(
+                cachefile, outputs[name].width, outputs[name].height, len(content))
+
+    if entries:
+        image.update_rendition_manifest(entries)
+    return generated, skipped
+
+
+def _generate_for_pk(model_label, pk, spec_names, force):
+    # Entry point of worker processes and threads.
+    if not apps.ready:
+        import django
+        django.setup()
+    model = apps.get_model(model_label)
+    image = model._default_manager.filter(pk=pk).first()
+    if image is None:
+        return 0, 0
+    return generate_renditions(image, spec_names, force)
+
+
+def _generate_in_thread(model_label, pk, spec_names):
+    try:
+        return _generate_for_pk(model_label, pk, spec_names, False)
+    finally:
+        # Connections are per thread, don't leave this one open.
+        connections.close_all()
+
+
+def _log_failure(future):
+    error = future.exception()
+    if error is not None:
+        logger.error("Unable to generate renditions: %s" % error, exc_info=error)
+
+
+def get_executor(workers=None):
+    """
+    Thread pool rendering the renditions of uploaded images; forking
+    processes from request handling server workers is not safe.
+    """
+    global _executor
+    workers = PREGENERATE_WORKERS if workers is None else workers
+    if not workers:
+        return None
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='media_archive_renditions')
+    return _executor
+
+
+def schedule_renditions(image, spec_names=None):
+    """
+    Render the specs of a freshly uploaded image in a background thread,
+    or synchronously if no workers are configured. Failures are logged.
+    """
+    executor = get_executor()
+    if executor is None:
+        try:
+            generate_renditions(image, spec_names)
+        except Exception as e:
+            logger.error("Unable to generate renditions of %s: %s" % (image, e))
+        return
+    future = executor.submit(
+        _generate_in_thread, image._meta.label, image.pk, spec_names)
+    future.add_done_callback(_log_failure)
+
+
+def pregenerate(queryset, spec_names=None, workers=None, force=False, callback=None):
+    """
+    Generate renditions for all images in ``queryset`` using ``workers``
+    processes, each handling one image at a time.
+
+    Returns a dict with ``images``, ``generated``, ``skipped``, ``errors``
+    and ``seconds``; ``callback`` is called with that dict after every image.
+    """
+    stats = {'images': 0, 'generated': 0, 'skipped': 0, 'errors': 0, 'seconds': 0.0}
+    start = time.monotonic()
+
+    def done(result=None, error=None):
+        stats['images'] += 1
+        if error is not None:
+            stats['errors'] += 1
+        else:
+            stats['generated'] += result[0]
+            stats['skipped'] += result[1]
+        stats['seconds'] = time.monotonic() - start
+        if callback is not None:
+            callback(stats)
+
+    if not workers:
+        for image in queryset.order_by('pk').iterator():
+            try:
+                done(generate_renditions(image, spec_names, force))
+            except Exception as e:
+                logger.error("Unable to generate renditions of %s: %s" % (image, e))
+                done(error=e)
+        return stats
+
+    model_label = queryset.model._meta.label
+    pks = list(queryset.order_by('pk').values_list('pk', flat=True))
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_generate_for_pk, model_label, pk, spec_names, force)
+            for pk in pks
+        ]
+        for future in as_completed(futures):
+            try:
+                done(future.result())
+            except Exception as e:
+                logger.error("Unable to generate renditions: %s" % e)
+                done(error=e)
+    return stats
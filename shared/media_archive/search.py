@@ -0,0 +1,128 @@
+"""
+Search over the denormalized ``search_text`` document of media and
+galleries.
+
+PostgreSQL uses a trigram GIN index on ``search_text`` (requires the
+``pg_trgm`` extension), SQLite a FTS5 table kept in sync by triggers,
+both are created after migrating. Other databases use a plain
+``icontains`` lookup on the single document column.
+"""
+import logging
+
+from django.apps import apps
+from django.db import DatabaseError, connections, transaction
+from django.db.models.expressions import RawSQL
+
+
+logger = logging.getLogger(__name__)
+
+
+def fts_table(model):
+    return '%s_fts' % model._meta.db_table
+
+
+def use_fts(using):
+    return connections[using].vendor == 'sqlite'
+
+
+def search_models():
+    from .models import SearchDocumentMixin
+
+    return [model for model in apps.get_models() if issubclass(model, SearchDocumentMixin)]
+
+
+def create_fts_table(model, using='default'):
+    """
+    Create the SQLite FTS5 table of ``model`` and the triggers keeping it
+    in sync with ``search_text``. SQLite drops the triggers when a migration
+    remakes the table, they are created again after every migrate.
+
+    Never call this inside a transaction which may be rolled back, SQLite
+    does not survive rolling back the creation of a virtual table.
+    """
+    table = model._meta.db_table
+    names = {'table': table, 'fts': fts_table(model), 'pk': model._meta.pk.column}
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS "%(fts)s" USING fts5(search_text)' % names)
+        cursor.execute(
+            'CREATE TRIGGER IF NOT EXISTS "%(fts)s_insert" AFTER INSERT ON "%(table)s" BEGIN'
+            ' INSERT INTO "%(fts)s" (rowid, search_text) VALUES (new."%(pk)s", new.search_text);'
+            ' END' % names)
+        cursor.execute(
+            'CREATE TRIGGER IF NOT EXISTS "%(fts)s_update"'
+            ' AFTER UPDATE OF search_text ON "%(table)s" BEGIN'
+            ' DELETE FROM "%(fts)s" WHERE rowid = old."%(pk)s";'
+            ' INSERT INTO "%(fts)s" (rowid, search_text) VALUES (new."%(pk)s", new.search_text);'
+            ' END' % names)
+        cursor.execute(
+            'CREATE TRIGGER IF NOT EXISTS "%(fts)s_delete" AFTER DELETE ON "%(table)s" BEGIN'
+            ' DELETE FROM "%(fts)s" WHERE rowid = old."%(pk)s";'
+            ' END' % names)
+
+
+def rebuild_fts_table(model, using='default'):
+    if not use_fts(using):
+        return
+    create_fts_table(model, using)
+    with connections[using].cursor() as cursor:
+        cursor.execute('DELETE FROM "%s"' % fts_table(model))
+        cursor.execute(
+            'INSERT INTO "%s" (rowid, search_text) SELECT "%s", search_text FROM "%s"' % (
+                fts_table(model), model._meta.pk.column, model._meta.db_table))
+
+
+def create_trigram_index(model, using='default'):
+    """
+    Django compiles ``icontains`` to ``UPPER("search_text"::text) LIKE
+    UPPER(%s)`` on PostgreSQL, the index covers exactly this expression.
+    """
+    table = model._meta.db_table
+    connection = connections[using]
+    try:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS "%s_search_trgm" ON "%s" '
+                'USING gin ((UPPER("search_text"::text)) gin_trgm_ops)' % (table, table))
+    except DatabaseError as e:
+        logger.warning("Unable to create trigram index on %s: %s" % (table, e))
+
+
+def create_search_indexes(using='default', **kwargs):
+    """
+    post_migrate handler creating the trigram indexes on PostgreSQL and the
+    FTS tables on SQLite. Neither is declared in the models, which would
+    make the migrations of the project depend on the database backend.
+    """
+    vendor = connections[using].vendor
+    for model in search_models():
+        if vendor == 'postgresql':
+            create_trigram_index(model, using)
+        elif vendor == 'sqlite':
+            create_fts_table(model, using)
+
+
+def search(queryset, search_term):
+    """
+    Filter ``queryset`` to objects whose search document contains all
+    words of ``search_term``.
+    """
+    terms = search_term.split()
+    if not terms:
+        return queryset
+    model = queryset.model
+    if use_fts(queryset.db):
+        # Quoted prefix queries, all terms must match. The matches are a
+        # subquery, a list of primary keys can exceed the variable limit.
+        match = ' '.join('"%s"*' % t.replace('"', '""') for t in terms)
+        matches = queryset.filter(pk__in=RawSQL(
+            'SELECT rowid FROM "%s" WHERE "%s" MATCH %%s' % (
+                fts_table(model), fts_table(model)),
+            [match]))
+        if matches.exists():
+            return matches
+        # FTS only matches the start of words, look for substrings such
+        # as "mg_1" in "img_1.jpg" before giving up.
+    for term in terms:
+        queryset = queryset.filter(search_text__icontains=term)
+    return queryset
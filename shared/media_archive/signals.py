@@ -0,0 +1,52 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import models
+from .cache import invalidate_category_filter_choices
+from .conf import PREGENERATE_ON_UPLOAD
+from .renditions import schedule_renditions
+
+
+@receiver(m2m_changed)
+def media_categories_changed(sender, instance, action, reverse, model, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    media_model = model if reverse else type(instance)
+    if issubclass(media_model, models.MediaBase):
+        invalidate_category_filter_choices(media_model)
+
+
+@receiver(post_delete)
+def media_deleted(sender, instance, **kwargs):
+    if issubclass(sender, models.MediaBase):
+        invalidate_category_filter_choices(sender)
+        if instance.file:
+            instance.delete_mediafile()
+
+
+@receiver(post_save, sender=models.MediaCategory)
+@receiver(post_delete, sender=models.MediaCategory)
+def category_changed(sender, **kwargs):
+    # Category names are part of the cached choice titles.
+    for media_model in models.media_models():
+        invalidate_category_filter_choices(media_model)
+
+
+@receiver(post_save, sender=models.Image)
+def image_saved(sender, instance, created, **kwargs):
+    if not PREGENERATE_ON_UPLOAD or not instance.file:
+        return
+    if created or instance.file.name != getattr(instance, '_original_file_name', None):
+        transaction.on_commit(lambda: schedule_renditions(instance))
+
+
+@receiver(post_save, sender=models.ImageGalleryRel)
+@receiver(post_delete, sender=models.ImageGalleryRel)
+def gallery_image_changed(sender, instance, **kwargs):
+    models.Gallery.objects.filter(pk=instance.gallery_id).bump_version()
+
+
+@receiver(post_save, sender=models.Image)
+def gallery_image_saved(sender, instance, **kwargs):
+    models.Gallery.objects.filter(images=instance).bump_version()
@@ -3,12 +3,145 @@ window.jQuery(function($) {
 		return;
 
 	var dragCounter = 0,
+		maxBatchFiles = 20,
+		maxBatchBytes = 20 * 1024 * 1024,
+		chunkSize = 8 * 1024 * 1024,
+		maxParallel = 3,
+		maxRetries = 5,
 		results = $('.results');
 
+	function csrfToken() {
+		return $('input[name=csrfmiddlewaretoken]').val();
+	}
+
+	function randomId() {
+		var bytes = new Uint8Array(16), id = '';
+		window.crypto.getRandomValues(bytes);
+		for (var i=0; i<bytes.length; ++i)
+			id += (bytes[i] + 0x100).toString(16).slice(1);
+		return id;
+	}
+
+	// Every drop gets a new upload id, dropping the same file again must
+	// not return the result of the earlier upload. The id is remembered
+	// until the commit succeeds, so an interrupted drop can resume after
+	// reloading the page.
+	function storageKey(file) {
+		return 'media_archive_upload:' + window.location.pathname + window.location.search +
+			':' + file.name + ':' + file.size + ':' + file.lastModified;
+	}
+
+	function uploadId(file) {
+		var key = storageKey(file), id;
+		try {
+			id = window.localStorage.getItem(key);
+			if (!id) {
+				id = randomId();
+				window.localStorage.setItem(key, id);
+			}
+		} catch (e) {
+			id = id || randomId();  // Storage disabled or full
+		}
+		return id;
+	}
+
+	function forgetUploadId(file) {
+		try {
+			window.localStorage.removeItem(storageKey(file));
+		} catch (e) {}
+	}
+
+	function postForm(url, data, onProgress) {
+		var d = new FormData();
+		d.append('csrfmiddlewaretoken', csrfToken());
+		$.each(data, function(key, value) {
+			if ($.isArray(value)) {
+				value.forEach(function(v) { d.append(key, v); });
+			} else {
+				d.append(key, value);
+			}
+		});
+		return $.ajax({
+			url: url + window.location.search,
+			type: 'POST',
+			data: d,
+			contentType: false,
+			processData: false,
+			xhr: function() {
+				var xhr = new XMLHttpRequest();
+				if (onProgress) {
+					xhr.upload.addEventListener('progress', function(e) {
+						if (e.lengthComputable)
+							onProgress(e.loaded, e.total);
+					}, false);
+				}
+				return xhr;
+			},
+		});
+	}
+
+	// Upload one large file in chunks, resuming at the offset the server
+	// reports after an error.
+	function uploadChunked(file, onProgress) {
+		var deferred = $.Deferred(),
+			id = uploadId(file),
+			retries = 0;
+
+		function fail() {
+			if (++retries > maxRetries) {
+				deferred.reject();
+				return;
+			}
+			setTimeout(resume, 1000 * retries);
+		}
+
+		function resume() {
+			$.getJSON('./upload/chunk/', {upload_id: id}).done(function(data) {
+				send(data.offset);
+			}).fail(fail);
+		}
+
+		function send(offset) {
+			if (offset >= file.size) {
+				postForm('./upload/commit/', {
+					upload_id: id, name: file.name, size: file.size
+				}).done(function() {
+					forgetUploadId(file);
+					deferred.resolve();
+				}).fail(function(xhr) {
+					if (xhr.status === 409) {
+						send(xhr.responseJSON.offset);
+					} else {
+						fail();
+					}
+				});
+				return;
+			}
+			postForm('./upload/chunk/', {
+				upload_id: id,
+				offset: offset,
+				chunk: file.slice(offset, offset + chunkSize),
+			}, function(loaded) {
+				onProgress(offset + loaded, file.size);
+			}).done(function(data) {
+				retries = 0;
+				send(data.offset);
+			}).fail(function(xhr) {
+				if (xhr.status === 409 && xhr.responseJSON) {
+					send(xhr.responseJSON.offset);
+				} else {
+					fail();
+				}
+			});
+		}
+
+		resume();
+		return deferred.promise();
+	}
+
 	results.on('drag dragstart dragend dragover dragenter dragleave drop', function(e) {
 		e.preventDefault();
 		e.stopPropagation();
-		console.log(e);
 	}).on('dragover dragenter', function(e) {
 		++dragCounter;
 		results.addClass('dragover');
@@ -23,41 +156,71 @@ window.jQuery(function($) {
 		results.removeClass('dragover');
 
 		var files = e.originalEvent.dataTransfer.files,
-			success = 0,
+			jobs = [],
+			batch = [],
+			batchBytes = 0,
+			running = 0,
+			done = 0,
+			failed = 0,
 			progress = $('<div class="progress">0 / ' + files.length + '</div>');
 
 		progress.appendTo(results);
 
+		function showProgress(loaded, total) {
+			var text = '' + done + ' / ' + files.length;
+			if (total)
+				text = Math.round(loaded / total * 100) + '% of ' + text;
+			if (failed)
+				text += ' (' + failed + ' failed)';
+			progress.html(text);
+		}
+
+		// Send several small files per request, large files in chunks.
 		for (var i=0; i<files.length; ++i) {
-			var d = new FormData();
-			d.append('csrfmiddlewaretoken', $('input[name=csrfmiddlewaretoken]').val());
-			d.append('file', files[i]);
-
-			$.ajax({
-				url: './upload/' + window.location.search,
-				type: 'POST',
-				data: d,
-				contentType: false,
-				processData: false,
-				success: function() {
-					progress.html('' + ++success + ' / ' + files.length);
-					if (success >= files.length) {
+			if (files[i].size > chunkSize) {
+				jobs.push({chunked: true, files: [files[i]]});
+				continue;
+			}
+			if (batch.length && (batch.length >= maxBatchFiles ||
+					batchBytes + files[i].size > maxBatchBytes)) {
+				jobs.push({files: batch});
+				batch = [];
+				batchBytes = 0;
+			}
+			batch.push(files[i]);
+			batchBytes += files[i].size;
+		}
+		if (batch.length)
+			jobs.push({files: batch});
+
+		function next() {
+			if (!jobs.length) {
+				if (!running) {
+					showProgress();
+					if (!failed)
 						window.location.reload();
-					}
-				},
-				xhr: function() {
-					var xhr = new XMLHttpRequest();
-					xhr.upload.addEventListener('progress', function(e) {
-						if (e.lengthComputable) {
-							progress.html(
-								Math.round(e.loaded / e.total * 100) + '% of ' +
-								(success + 1) + ' / ' + files.length
-							);
-						}
-					}, false);
-					return xhr;
-				},
+				}
+				return;
+			}
+			var job = jobs.shift(), request;
+			++running;
+			if (job.chunked) {
+				request = uploadChunked(job.files[0], showProgress);
+			} else {
+				request = postForm('./upload/', {file: job.files}, showProgress);
+			}
+			request.done(function() {
+				done += job.files.length;
+			}).fail(function() {
+				failed += job.files.length;
+			}).always(function() {
+				--running;
+				showProgress();
+				next();
 			});
 		}
+
+		for (var j=0; j<maxParallel; ++j)
+			next();
 	});
 });
@@ -0,0 +1,55 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+
+register = template.Library()
+
+
+def _rendition_set(image, set_name):
+    return image.get_rendition_manifest().get('set:%s' % set_name) or []
+
+
+def _srcset(entries, fmt):
+    return ', '.join(
+        '%s %dw' % (e['url'], e['width'])
+        for e in sorted(entries, key=lambda e: e['width']) if e['format'] == fmt)
+
+
+@register.simple_tag
+def srcset(image, set_name, fmt='JPEG'):
+    """
+    ``srcset`` attribute value of a rendition set in one format.
+
+        <img src="..." srcset="{% srcset image 'responsive' %}" sizes="100vw">
+    """
+    return _srcset(_rendition_set(image, set_name), fmt)
+
+
+@register.simple_tag
+def picture(image, set_name='responsive', sizes='100vw', alt='', css_class=''):
+    """
+    ``<picture>`` element with one ``<source>`` per modern format of a
+    rendition set and the last format (usually JPEG) as ``<img>`` fallback.
+    Falls back to the original file until the set has been generated.
+
+        {% picture image 'responsive' sizes='(min-width: 60em) 50vw, 100vw' alt=image.name %}
+    """
+    entries = _rendition_set(image, set_name)
+    if not entries:
+        return format_html(
+            '<img src="{}" alt="{}" class="{}">', image.file.url, alt, css_class)
+
+    formats = list(dict.fromkeys(e['format'] for e in entries))
+    fallback_format = formats[-1]
+    fallback = max(
+        (e for e in entries if e['format'] == fallback_format), key=lambda e: e['width'])
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        (
+            (next(e['type'] for e in entries if e['format'] == fmt), _srcset(entries, fmt), sizes)
+            for fmt in formats[:-1]
+        ))
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" class="{}"></picture>',
+        sources, fallback['url'], _srcset(entries, fallback_format), sizes,
+        fallback['width'], fallback['height'], alt, css_class)
@@ -0,0 +1,15 @@
+from django.conf.urls import url
+
+from . import views
+
+
+app_name = 'media_archive'
+
+urlpatterns = [
+    url(r'^galleries/(?P<pk>\d+)/zip/$', views.gallery_zip, name='gallery_zip'),
+    url(r'^api/galleries/$', views.api_galleries, name='api_galleries'),
+    url(r'^api/galleries/(?P<pk>\d+)/$', views.api_gallery, name='api_gallery'),
+    url(r'^api/images/(?P<pk>\d+)/$', views.api_image, name='api_image'),
+    url(r'^api/downloads/$', views.api_downloads, name='api_downloads'),
+    url(r'^api/downloads/(?P<pk>\d+)/$', views.api_download, name='api_download'),
+]
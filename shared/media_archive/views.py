@@ -0,0 +1,177 @@
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max
+from django.db.models.functions import Length
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import condition
+
+from .conf import API_CACHE_TIMEOUT
+from .exports import zip_response
+from .models import Download, Gallery, Image
+from .renditions import image_spec_names
+
+
+def gallery_zip(request, pk):
+    """
+    Zip of the public images of a public gallery, optionally of the
+    rendition given by ``?rendition=<spec name>``.
+    """
+    gallery = get_object_or_404(Gallery.objects.public(), pk=pk)
+    spec = request.GET.get('rendition') or None
+    if spec is not None and spec not in image_spec_names(Image):
+        raise Http404
+    return zip_response(
+        iter(gallery.public_images()),
+        '%s.zip' % (gallery.slug or gallery.pk), spec)
+
+
+#
+# Read-only JSON API of public galleries, images and downloads
+#
+# Responses carry strong ETags derived from modification times and gallery
+# versions; conditional requests are answered with 304 before anything is
+# serialized, full responses are cached under their ETag.
+
+def image_data(image):
+    manifest = image.get_rendition_manifest()
+    return {
+        'id': image.pk,
+        'name': image.name,
+        'caption': image.caption,
+        'credits': image.credits,
+        'copyright': image.copyright,
+        'url': image.file.url if image.file else None,
+        'width': image.image_width,
+        'height': image.image_height,
+        'modified': image.modified.isoformat(),
+        # Only generated renditions, resolving others would hit the storage.
+        'renditions': {
+            name: entry for name, entry in manifest.items() if not name.startswith('set:')},
+        'rendition_sets': {
+            name[4:]: entry for name, entry in manifest.items() if name.startswith('set:')},
+    }
+
+
+def download_data(download):
+    return {
+        'id': download.pk,
+        'name': download.get_display_name(),
+        'caption': download.caption,
+        'type': download.type,
+        'url': download.file.url if download.file else None,
+        'size': download.file_size,
+        'modified': download.modified.isoformat(),
+    }
+
+
+def gallery_data(gallery, images=None):
+    data = {
+        'id': gallery.pk,
+        'name': gallery.name,
+        'slug': gallery.slug,
+        'caption': gallery.caption,
+        'credits': gallery.credits,
+        'version': gallery.version,
+    }
+    if images is not None:
+        data['images'] = [image_data(image) for image in images]
+    else:
+        data['image_count'] = gallery.public_image_count or 0
+    return data
+
+
+def _timestamp(value):
+    return value.timestamp() if value else 0
+
+
+def _galleries_etag(request):
+    # A sum of versions would not change if one gallery is bumped while
+    # another is unpublished, hash the (pk, version) pairs instead.
+    digest = hashlib.md5()
+    rows = Gallery.objects.public().order_by('pk').values_list('pk', 'version')
+    for pk, version in rows.iterator():
+        digest.update(b'%d:%d,' % (pk, version))
+    return 'galleries-%s' % digest.hexdigest()
+
+
+def _gallery_etag(request, pk):
+    version = Gallery.objects.public().filter(pk=pk).values_list('version', flat=True).first()
+    return None if version is None else 'gallery-%s-%s' % (pk, version)
+
+
+def _media_list_etag(model):
+    def etag(request):
+        stats = model.objects.public().aggregate(n=Count('pk'), m=Max('modified'))
+        return '%s-%s-%s' % (model._meta.model_name, stats['n'], _timestamp(stats['m']))
+    return etag
+
+
+def _media_etag(model, **annotations):
+    def etag(request, pk):
+        row = model.objects.public().filter(pk=pk).annotate(**annotations).values_list(
+            'modified', *annotations).first()
+        if row is None:
+            return None
+        return '-'.join(str(v) for v in (
+            model._meta.model_name, pk, _timestamp(row[0])) + row[1:])
+    return etag
+
+
+def cached_json(etag_func, build):
+    """
+    JSON response of ``build()``, cached under the current ETag.
+    """
+    def request_etag(request, *args, **kwargs):
+        # Computed once for the conditional check and the view.
+        if not hasattr(request, '_media_archive_etag'):
+            request._media_archive_etag = etag_func(request, *args, **kwargs)
+        return request._media_archive_etag
+
+    def view(request, *args, **kwargs):
+        etag = request_etag(request, *args, **kwargs)
+        if etag is None:
+            raise Http404
+        key = 'media_archive:api:%s' % hashlib.md5(etag.encode()).hexdigest()
+        content = cache.get(key)
+        if content is None:
+            content = json.dumps(build(*args, **kwargs), cls=DjangoJSONEncoder)
+            cache.set(key, content, API_CACHE_TIMEOUT)
+        return HttpResponse(content, content_type='application/json')
+    return condition(etag_func=request_etag)(view)
+
+
+def _galleries():
+    return {'galleries': [
+        gallery_data(g) for g in Gallery.objects.public().with_image_stats()]}
+
+
+def _gallery(pk):
+    gallery = get_object_or_404(Gallery.objects.public().prefetch_public_images(), pk=pk)
+    return gallery_data(gallery, gallery.public_images())
+
+
+def _image(pk):
+    return image_data(get_object_or_404(Image.objects.public(), pk=pk))
+
+
+def _downloads():
+    return {'downloads': [
+        download_data(d) for d in Download.objects.public_by_name().iterator()]}
+
+
+def _download(pk):
+    return download_data(get_object_or_404(Download.objects.public(), pk=pk))
+
+
+api_galleries = cached_json(_galleries_etag, _galleries)
+api_gallery = cached_json(_gallery_etag, _gallery)
+# Manifest updates leave modified alone, but only ever add entries.
+api_image = cached_json(
+    _media_etag(Image, manifest_length=Length('rendition_manifest')),
+    _image)
+api_downloads = cached_json(_media_list_etag(Download), _downloads)
+api_download = cached_json(_media_etag(Download), _download)
@@ -0,0 +1,99 @@
+from unittest import mock
+
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from shared.media_archive import admin_actions
+from shared.media_archive.models import Gallery, Image, ImageGalleryRel, MediaCategory
+
+from .utils import create_images
+
+
+def run_action(action, queryset, target):
+    with mock.patch.object(action, 'get_target', return_value=target):
+        return action.apply(queryset, None)
+
+
+class SetBasedActionsTest(TestCase):
+    def test_add_images_to_gallery_query_count(self):
+        small = create_images(3, prefix='small')
+        large = create_images(60, prefix='large')
+        action = admin_actions.add_images_to_gallery
+
+        gallery = Gallery.objects.create(internal_name='small')
+        with CaptureQueriesContext(connection) as queries:
+            count = run_action(action, Image.objects.filter(pk__in=[i.pk for i in small]), gallery)
+        self.assertEqual(count, 3)
+
+        gallery = Gallery.objects.create(internal_name='large')
+        with self.assertNumQueries(len(queries)):
+            count = run_action(action, Image.objects.filter(pk__in=[i.pk for i in large]), gallery)
+        self.assertEqual(count, 60)
+
+    def test_add_images_to_gallery_appends(self):
+        images = create_images(5)
+        gallery = Gallery.objects.create(internal_name='gallery')
+        action = admin_actions.add_images_to_gallery
+
+        self.assertEqual(run_action(action, Image.objects.filter(pk__in=[
+            i.pk for i in images[:2]]), gallery), 2)
+        # Already contained images are skipped and not counted.
+        self.assertEqual(run_action(action, Image.objects.filter(pk__in=[
+            i.pk for i in images]), gallery), 3)
+
+        rels = list(ImageGalleryRel.objects.filter(gallery=gallery).order_by('position'))
+        self.assertEqual([rel.image_id for rel in rels], [i.pk for i in images])
+        positions = [rel.position for rel in rels]
+        self.assertEqual(positions, sorted(set(positions)))
+
+    def test_assign_category_query_count(self):
+        small = create_images(3, prefix='small')
+        large = create_images(60, prefix='large')
+        action = admin_actions.assign_category
+
+        category = MediaCategory.objects.create(name='Small')
+        with CaptureQueriesContext(connection) as queries:
+            count = run_action(action, Image.objects.filter(pk__in=[i.pk for i in small]), category)
+        self.assertEqual(count, 3)
+
+        category = MediaCategory.objects.create(name='Large')
+        with self.assertNumQueries(len(queries)):
+            count = run_action(action, Image.objects.filter(pk__in=[i.pk for i in large]), category)
+        self.assertEqual(count, 60)
+
+        # Existing assignments are not counted again.
+        self.assertEqual(run_action(action, Image.objects.filter(pk__in=[
+            i.pk for i in small + large]), category), 3)
+        self.assertEqual(category.image_set.count(), 63)
+
+
+class GalleryVersionTest(TestCase):
+    def test_save_keeps_concurrent_bumps(self):
+        gallery = Gallery.objects.create(internal_name='gallery')
+        stale = Gallery.objects.get(pk=gallery.pk)
+        Gallery.objects.filter(pk=gallery.pk).bump_version()
+        stale.save()
+        self.assertEqual(stale.version, gallery.version + 2)
+        self.assertEqual(Gallery.objects.get(pk=gallery.pk).version, gallery.version + 2)
+
+    def test_change_is_public_bumps_galleries(self):
+        images = create_images(2)
+        gallery = Gallery.objects.create(internal_name='gallery')
+        other = Gallery.objects.create(internal_name='other')
+        ImageGalleryRel.objects.create(gallery=gallery, image=images[0], position=10)
+        gallery.refresh_from_db()
+        before = gallery.version
+
+        request = RequestFactory().post('/', {
+            'apply': '1',
+            '_selected_action': [images[0].pk],
+            'is_public': 'True',
+        })
+        modeladmin = mock.Mock(spec=['message_user'])
+        response = admin_actions.MediaBaseActionsMixin.change_is_public_action(
+            modeladmin, request, Image.objects.filter(pk=images[0].pk))
+        self.assertEqual(response.status_code, 302)
+
+        self.assertEqual(Gallery.objects.get(pk=gallery.pk).version, before + 1)
+        self.assertEqual(Gallery.objects.get(pk=other.pk).version, other.version)
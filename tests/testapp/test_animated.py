@@ -0,0 +1,40 @@
+from django.test import TestCase
+
+from shared.media_archive.models import Image
+from shared.media_archive.renditions import generate_renditions
+
+from .utils import animated_gif_data, stored_file
+
+
+class AnimatedImageTest(TestCase):
+    def setUp(self):
+        self.image = Image.objects.create(
+            file=stored_file('archive/anim.gif', animated_gif_data()),
+            slug='anim', image_format='GIF', is_animated=True,
+            image_width=300, image_height=200)
+
+    def test_passthrough_specs(self):
+        self.assertEqual(self.image.lightbox_image.url, self.image.file.url)
+        self.assertEqual(self.image.gif_gallery_image_thumbnail().url, self.image.file.url)
+        self.assertEqual(self.image.gif_lightbox_image().url, self.image.file.url)
+
+    def test_resized_specs(self):
+        # The first frame until an animated rendition exists.
+        square = self.image.square_image
+        self.assertNotEqual(square.url, self.image.file.url)
+        self.assertEqual((square.width, square.height), (800, 800))
+        self.assertNotEqual(self.image.thumbnail.url, self.image.file.url)
+
+        generate_renditions(self.image)
+        image = Image.objects.get(pk=self.image.pk)
+        manifest = image.get_rendition_manifest()
+        self.assertIn('square_image', manifest)
+        self.assertNotIn('lightbox_image', manifest)
+        self.assertEqual(image.square_image.url, manifest['square_image']['url'])
+        self.assertEqual((image.square_image.width, image.square_image.height), (800, 800))
+
+    def test_rendition_sets(self):
+        generate_renditions(self.image)
+        manifest = Image.objects.get(pk=self.image.pk).get_rendition_manifest()
+        self.assertIn('set:responsive', manifest)
+        self.assertIn('set:square', manifest)
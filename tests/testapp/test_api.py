@@ -0,0 +1,34 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from shared.media_archive.models import Gallery
+from shared.media_archive.views import _galleries_etag
+
+
+class GalleriesApiTest(TestCase):
+    url = '/media-archive/api/galleries/'
+
+    def setUp(self):
+        cache.clear()
+
+    def test_etag_computed_once(self):
+        Gallery.objects.create(internal_name='gallery', is_public=True)
+        # The ETag and the gallery list.
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_follows_versions(self):
+        first = Gallery.objects.create(internal_name='first', is_public=True)
+        second = Gallery.objects.create(internal_name='second', is_public=True)
+        Gallery.objects.create(internal_name='third', is_public=True)
+        Gallery.objects.filter(pk=first.pk).bump_version()
+        etag = _galleries_etag(None)
+
+        # Same count, maximum pk and sum of versions.
+        Gallery.objects.filter(pk=first.pk).update(version=0)
+        Gallery.objects.filter(pk=second.pk).bump_version()
+        self.assertNotEqual(_galleries_etag(None), etag)
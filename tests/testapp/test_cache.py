@@ -0,0 +1,24 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from shared.media_archive.cache import category_filter_cache_key, get_category_filter_choices
+from shared.media_archive.models import Image, MediaCategory
+
+from .utils import create_images
+
+
+class CategoryFilterCacheTest(TestCase):
+    def test_invalidated_on_commit(self):
+        field = Image._meta.get_field('categories')
+        image = create_images(1)[0]
+        category = MediaCategory.objects.create(name='Category')
+        cache.delete(category_filter_cache_key(field))
+        self.assertEqual(get_category_filter_choices(field), [])
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            image.categories.add(category)
+            # Not before the commit, concurrent requests would cache the
+            # old choices again.
+            self.assertEqual(cache.get(category_filter_cache_key(field)), [])
+        self.assertTrue(callbacks)
+        self.assertEqual(get_category_filter_choices(field), [(category.pk, 'Category (1)')])
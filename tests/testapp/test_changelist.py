@@ -0,0 +1,40 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from shared.media_archive.models import Download, Image, MediaCategory
+
+from .utils import create_downloads, create_images
+
+
+class ChangelistQueryCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_login(self.user)
+        parent = MediaCategory.objects.create(name='Parent')
+        self.categories = [
+            MediaCategory.objects.create(name='Child %d' % i, parent=parent)
+            for i in range(3)]
+
+    def changelist_queries(self, model, create, count):
+        objs = create(count, prefix='%s-%d' % (model._meta.model_name, count))
+        model.objects.add_categories([obj.pk for obj in objs], self.categories)
+        url = '/admin/media_archive/%s/' % model._meta.model_name
+        # Warm the cached category filter choices.
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, model, create):
+        small = self.changelist_queries(model, create, 2)
+        large = self.changelist_queries(model, create, 20)
+        self.assertEqual(small, large)
+
+    def test_image_changelist(self):
+        self.assertConstantQueries(Image, create_images)
+
+    def test_download_changelist(self):
+        self.assertConstantQueries(Download, create_downloads)
@@ -0,0 +1,19 @@
+from django.core.files.storage import default_storage
+from django.test import TestCase
+
+from shared.media_archive.deletions import process_pending_deletions
+from shared.media_archive.models import Image, PendingFileDeletion
+
+from .utils import create_images
+
+
+class PendingDeletionsTest(TestCase):
+    def test_shared_file_entries(self):
+        images = create_images(3, prefix='shared')
+        name = images[0].file.name
+        Image.objects.all().delete()
+        self.assertEqual(PendingFileDeletion.objects.filter(name=name).count(), 3)
+
+        self.assertEqual(process_pending_deletions(), 3)
+        self.assertFalse(PendingFileDeletion.objects.exists())
+        self.assertFalse(default_storage.exists(name))
@@ -0,0 +1,33 @@
+import io
+import posixpath
+import zipfile
+
+from django.test import TestCase
+
+from shared.media_archive.admin_actions import download_zip
+from shared.media_archive.models import Gallery, Image, ImageGalleryRel, MediaCategory
+
+from .utils import image_data, stored_file
+
+
+class ZipActionTest(TestCase):
+    def test_category_zip_has_no_duplicates(self):
+        category = MediaCategory.objects.create(name='Folder')
+        images = [
+            Image.objects.create(
+                file=stored_file('archive/zip-%d.png' % i, image_data()), slug='zip-%d' % i)
+            for i in range(3)]
+        Image.objects.add_categories([image.pk for image in images], [category])
+        # Gallery relations would duplicate rows through Image's default
+        # ordering.
+        for n in range(2):
+            gallery = Gallery.objects.create(internal_name='gallery %d' % n)
+            for position, image in enumerate(images[:2]):
+                ImageGalleryRel.objects.create(gallery=gallery, image=image, position=position)
+
+        response = download_zip(None, None, MediaCategory.objects.filter(pk=category.pk))
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(
+            sorted(archive.namelist()),
+            sorted(posixpath.basename(image.file.name) for image in images))
+
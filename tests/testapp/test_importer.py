@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from shared.utils.models.slugs import slugify
+
+from shared.media_archive.importer import MediaImporter, iter_directory
+from shared.media_archive.models import Download, Image, MediaCategory
+
+from .utils import image_data
+
+
+class ImporterTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def write(self, path, data):
+        path = os.path.join(self.root, *path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def test_import(self):
+        self.write('Events/2020/Summer/IMG_0001.jpg', image_data(format='JPEG'))
+        self.write('Events/2020/Summer/IMG_0002.jpg', image_data(format='JPEG'))
+        self.write('Events/Report.pdf', b'%PDF-1.4\n')
+
+        importer = MediaImporter(workers=2)
+        self.assertEqual(importer.run(iter_directory(self.root)), 3)
+
+        images = Image.objects.order_by('slug')
+        # Slugs come from the base name, not the storage path.
+        self.assertEqual([i.slug for i in images], [slugify('IMG_0001'), slugify('IMG_0002')])
+        download = Download.objects.get()
+        self.assertEqual(download.slug, slugify('Report'))
+        self.assertEqual(download.type, 'pdf')
+
+        # Working folders have two levels at most.
+        category = images[0].categories.get()
+        self.assertEqual(category.name, '2020/Summer')
+        self.assertEqual(category.parent.name, 'Events')
+        self.assertIsNone(category.parent.parent_id)
+        self.assertEqual(download.categories.get(), category.parent)
+        self.assertEqual(MediaCategory.objects.count(), 2)
@@ -0,0 +1,37 @@
+from django.test import TestCase
+
+from shared.media_archive.models import Download, Gallery, Image, MediaRole
+
+
+class IndexUsageTest(TestCase):
+    """
+    The declared Meta.indexes are used by the lookups they are made for,
+    according to SQLite's EXPLAIN QUERY PLAN.
+    """
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_public_by_name(self):
+        self.assertUsesIndex(Image.objects.public_by_name(), 'media_image_public_name')
+        self.assertUsesIndex(Download.objects.public_by_name(), 'media_download_public_name')
+
+    def test_public_for_role(self):
+        role = MediaRole.objects.create(id_text='press', name='Press')
+        self.assertUsesIndex(Image.objects.public_for_role(role), 'media_image_role_public')
+        self.assertUsesIndex(Download.objects.public_for_role(role), 'media_download_role_public')
+
+    def test_changelist_ordering(self):
+        self.assertUsesIndex(
+            Image.objects.order_by('-modified', '-pk')[:25], 'media_image_modified_id')
+        self.assertUsesIndex(
+            Download.objects.order_by('-modified', '-pk')[:25], 'media_download_modified_id')
+
+    def test_gallery_images(self):
+        gallery = Gallery.objects.create(internal_name='gallery')
+        self.assertUsesIndex(gallery.public_images(), 'media_gallery_position')
+
+    def test_public_galleries(self):
+        self.assertUsesIndex(
+            Gallery.objects.public().order_by('name'), 'media_gallery_public_name')
@@ -0,0 +1,31 @@
+from django.core.files.storage import default_storage
+from django.test import SimpleTestCase, TestCase
+
+from shared.media_archive.models import Image
+from shared.media_archive.orphans import merge_unreferenced, unreferenced_files
+
+from .utils import image_data, stored_file
+
+
+class UnreferencedFilesTest(TestCase):
+    def test_unreferenced_files(self):
+        # Punctuation sorts differently in most database collations.
+        names = [stored_file('orphans/%s.png' % n, image_data()) for n in (
+            'a-b', 'a_b', 'aB', 'a.b', 'sub/a')]
+        orphans = [stored_file('orphans/%s.png' % n, image_data()) for n in (
+            'a-c', 'z', 'sub/b')]
+        Image.objects.bulk_create([
+            Image(file=name, slug='orphans-%d' % i) for i, name in enumerate(names)])
+
+        self.assertEqual(
+            sorted(unreferenced_files(default_storage, 'orphans')), sorted(orphans))
+
+
+class MergeTest(SimpleTestCase):
+    def test_merge(self):
+        self.assertEqual(
+            list(merge_unreferenced(['a', 'b', 'c', 'd'], ['b', 'd', 'e'])), ['a', 'c'])
+
+    def test_unsorted_references(self):
+        with self.assertRaises(ValueError):
+            list(merge_unreferenced(['a', 'b', 'c', 'd'], ['c', 'b']))
@@ -0,0 +1,45 @@
+from django.core.paginator import Paginator
+from django.test import TestCase
+
+from shared.media_archive.models import Image
+from shared.media_archive.paginator import KeysetPaginator
+
+from .utils import create_images
+
+
+class KeysetPaginatorTest(TestCase):
+    def setUp(self):
+        create_images(23)
+        self.queryset = Image.objects.order_by('-modified', '-pk')
+        self.expected = [
+            [obj.pk for obj in page]
+            for page in (Paginator(self.queryset, 5).page(n) for n in range(1, 6))]
+
+    def test_next_cursor(self):
+        page = KeysetPaginator(self.queryset, 5).page(1)
+        pages = [[obj.pk for obj in page]]
+        while page.next_cursor:
+            page = KeysetPaginator(self.queryset, 5, cursor=page.next_cursor).page(
+                page.number + 1)
+            pages.append([obj.pk for obj in page])
+        self.assertEqual(pages, self.expected)
+
+    def test_previous_cursor(self):
+        page = KeysetPaginator(self.queryset, 5).page(5)
+        pages = [[obj.pk for obj in page]]
+        while page.previous_cursor:
+            page = KeysetPaginator(self.queryset, 5, cursor=page.previous_cursor).page(
+                page.number - 1)
+            pages.append([obj.pk for obj in page])
+        self.assertEqual(pages[::-1], self.expected)
+
+    def test_cursor_query_has_no_offset(self):
+        first = KeysetPaginator(self.queryset, 5).page(1)
+        list(first)
+        page = KeysetPaginator(self.queryset, 5, cursor=first.next_cursor).page(2)
+        self.assertNotIn('OFFSET', str(page.object_list.query))
+
+    def test_filtered_count_is_exact(self):
+        paginator = KeysetPaginator(self.queryset.filter(pk__lte=self.expected[0][0]), 5)
+        self.assertEqual(paginator.count, self.queryset.filter(
+            pk__lte=self.expected[0][0]).count())
@@ -0,0 +1,34 @@
+from django.test import TestCase
+
+from shared.media_archive.models import Image
+from shared.media_archive.renditions import generate_renditions, rendition_set_directory
+
+from .utils import image_data, stored_file
+
+
+class RenditionSetTest(TestCase):
+    def setUp(self):
+        self.image = Image.objects.create(
+            file=stored_file('archive/sets.png', image_data((500, 300))),
+            slug='sets', image_width=500, image_height=300)
+
+    def set_files(self):
+        storage = self.image.file.storage
+        dirs, files = storage.listdir(rendition_set_directory(self.image.file.name))
+        return sorted(f for f in files if f.startswith(('responsive-', 'square-')))
+
+    def test_ppoi_change_deletes_old_sets(self):
+        generate_renditions(self.image)
+        old_files = self.set_files()
+        self.assertTrue(old_files)
+
+        image = Image.objects.get(pk=self.image.pk)
+        image.image_ppoi = '0.2x0.8'
+        with self.captureOnCommitCallbacks(execute=True):
+            image.save()
+        self.assertEqual(self.set_files(), [])
+
+        generate_renditions(image)
+        new_files = self.set_files()
+        self.assertEqual(len(new_files), len(old_files))
+        self.assertFalse(set(new_files) & set(old_files))
@@ -0,0 +1,45 @@
+import json
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from shared.media_archive.models import Gallery, ImageGalleryRel
+
+from .utils import create_images
+
+
+class ReorderImagesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_login(self.user)
+        self.gallery = Gallery.objects.create(internal_name='gallery')
+        for image in create_images(3):
+            ImageGalleryRel.objects.create(
+                gallery=self.gallery, image=image,
+                position=ImageGalleryRel.objects.next_position(self.gallery))
+        self.rels = list(ImageGalleryRel.objects.filter(
+            gallery=self.gallery).order_by('position').values_list('pk', flat=True))
+        self.url = '/admin/media_archive/gallery/%s/reorder/' % self.gallery.pk
+
+    def post_json(self, data):
+        return self.client.post(self.url, json.dumps(data), content_type='application/json')
+
+    def test_reorder(self):
+        response = self.post_json({'rel': self.rels[::-1]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(ImageGalleryRel.objects.filter(
+            gallery=self.gallery).order_by('position').values_list('pk', flat=True)),
+            self.rels[::-1])
+
+    def test_get_not_allowed(self):
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+    def test_invalid_input(self):
+        for data in [{}, {'rel': None}, {'rel': 'abc'}, {'rel': [1, 'x']}, [1, 2]]:
+            response = self.post_json(data)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['error'], "rel must be a list of ids.")
+        response = self.post_json({'rel': self.rels[:1]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()['error'], "rel_ids must list every image of the gallery once.")
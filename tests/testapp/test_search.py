@@ -0,0 +1,40 @@
+from django.db import transaction
+from django.test import TestCase
+
+from shared.media_archive.models import Gallery
+from shared.media_archive.search import search
+
+
+class SearchTest(TestCase):
+    def assertFound(self, term, expected):
+        self.assertEqual(list(search(Gallery.objects.order_by('pk'), term)), expected)
+
+    def test_word_prefixes(self):
+        summer = Gallery.objects.create(internal_name='Summer party 2020')
+        winter = Gallery.objects.create(internal_name='Winter party')
+        self.assertFound('part', [summer, winter])
+        self.assertFound('sum part', [summer])
+        self.assertFound('autumn', [])
+
+    def test_substrings(self):
+        gallery = Gallery.objects.create(internal_name='img_1')
+        self.assertFound('mg_1', [gallery])
+
+    def test_updates_and_deletes(self):
+        gallery = Gallery.objects.create(internal_name='Summer')
+        gallery.internal_name = 'Winter'
+        gallery.save()
+        self.assertFound('summer', [])
+        self.assertFound('winter', [gallery])
+        gallery.delete()
+        self.assertFound('winter', [])
+
+    def test_rolled_back_savepoint(self):
+        gallery = Gallery.objects.create(internal_name='Summer')
+        try:
+            with transaction.atomic():
+                Gallery.objects.create(internal_name='Summer rain')
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertFound('summer', [gallery])
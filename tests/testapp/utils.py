@@ -0,0 +1,44 @@
+import io
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image as PILImage
+
+from shared.media_archive.models import Download, Image
+
+
+def image_data(size=(40, 30), format='PNG', color='red'):
+    buf = io.BytesIO()
+    PILImage.new('RGB', size, color).save(buf, format)
+    return buf.getvalue()
+
+
+def stored_file(name, data):
+    return default_storage.save(name, ContentFile(data))
+
+
+def create_images(count, prefix='image', **kwargs):
+    """
+    ``count`` images sharing one stored file, created without save().
+    """
+    name = stored_file('archive/%s.png' % prefix, image_data())
+    Image.objects.bulk_create([
+        Image(file=name, slug='%s-%d' % (prefix, i),
+              image_width=40, image_height=30, **kwargs)
+        for i in range(count)])
+    return list(Image.objects.filter(slug__startswith='%s-' % prefix).order_by('pk'))
+
+
+def create_downloads(count, prefix='download', **kwargs):
+    name = stored_file('archive/%s.pdf' % prefix, b'%PDF-1.4\n')
+    Download.objects.bulk_create([
+        Download(file=name, slug='%s-%d' % (prefix, i), type='pdf', **kwargs)
+        for i in range(count)])
+    return list(Download.objects.filter(slug__startswith='%s-' % prefix).order_by('pk'))
+
+
+def animated_gif_data(size=(300, 200), colors=('red', 'green', 'blue')):
+    frames = [PILImage.new('RGB', size, color) for color in colors]
+    buf = io.BytesIO()
+    frames[0].save(buf, 'GIF', save_all=True, append_images=frames[1:], duration=50, loop=0)
+    return buf.getvalue()